@@ -0,0 +1,50 @@
+"""Refreshes many local blood bank sites at once and compares the time with the slowest single site
+
+    python benchmarks/bench_banks.py --banks 50 --slowest 1.0
+"""
+
+import argparse
+import json
+import random
+import time
+
+from fake_blood_bank import FakeBloodBank
+from harness import load_bot
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--banks', type=int, default=50)
+    arguments.add_argument('--slowest', type=float, default=1.0, help='latency of the slowest site, seconds')
+    options = arguments.parse_args()
+
+    generator = random.Random(1)
+    latencies = [generator.uniform(0.01, options.slowest / 2) for _ in range(options.banks - 1)] + [options.slowest]
+    sites = [FakeBloodBank(latency=latency).start() for latency in latencies]
+    bot_module = load_bot()
+    registry = bot_module.BankRegistry()
+    for number, site in enumerate(sites):
+        registry.register(bot_module.BloodBank(f'bank-{number}', f'Bank {number}', (0, 0)),
+                          bot_module.Parser(site.url, 'h4'))
+
+    started = time.monotonic()
+    snapshots = registry.refresh_all()
+    first_refresh = time.monotonic() - started
+    started = time.monotonic()
+    registry.refresh_all()  # every site answers 304 now
+    second_refresh = time.monotonic() - started
+    for site in sites:
+        site.stop()
+
+    print(json.dumps({
+        'banks': options.banks,
+        'slowest_site_s': options.slowest,
+        'first_refresh_s': round(first_refresh, 3),
+        'refresh_with_304_s': round(second_refresh, 3),
+        'parsed': sum(snapshot is not None for snapshot in snapshots.values()),
+        'answered_304': sum(site.not_modified for site in sites),
+    }, indent=4))
+
+
+if __name__ == '__main__':
+    main()
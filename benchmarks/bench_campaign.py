@@ -0,0 +1,127 @@
+"""Sends a broadcast campaign to about 100k donors through a local fake Bot API enforcing the rate limit, kills the
+sending process in the middle and starts it again: checks that the campaign resumes where it stopped, that nobody
+gets the message twice and that the sending keeps up with the rate limit
+
+    python benchmarks/bench_campaign.py --users 360000 --rate 300
+
+Both processes share the machine: a single core sustains about 450 messages/s of the sender and the fake API
+together, a higher --rate needs more cores to be reached
+"""
+
+import argparse
+import collections
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+from bench_startup import prepare_workdir
+from fake_bot_api import FakeBotApi
+from harness import load_bot
+
+ADMIN_ID = 1
+BLOOD_GROUP = 'I(+)'  # about 28% of the synthetic users
+TEXT = 'Терміново потрібна кров I (+)! Приходь до Центру Крові цього тижня'
+
+
+def run_sender(workdir: str, api_url: str, rate: float, workers: int):
+    """Runs inside the sending process: starts the campaign or resumes the interrupted one,
+    prints the progress reports as json lines"""
+
+    # the fake API counts the arrivals within a second, the bot aims a little under the limit
+    bot = load_bot(workdir, admin_ids=[ADMIN_ID], send_rate=rate * 0.95, send_workers=workers)
+    bot.telebot.apihelper.API_URL = api_url
+    bot.campaigns.report_every = 5
+    bot.campaigns.subscribe(lambda progress: print(json.dumps(progress._asdict()), flush=True))
+    bot.dispatcher.start()
+    resumed = bot.campaigns.resume()
+    campaign_id = resumed[0] if resumed else bot.campaigns.create(BLOOD_GROUP, TEXT, ADMIN_ID)
+    bot.campaigns.wait(campaign_id)
+    bot.dispatcher.stop()
+
+
+def start_sender(workdir: str, api: FakeBotApi, options, reports: list) -> subprocess.Popen:
+    process = subprocess.Popen([sys.executable, __file__, '--rate', str(options.rate), '--workers', str(options.workers),
+                                '--run', workdir, api.api_url], stdout=subprocess.PIPE, text=True)
+
+    def read():
+        for line in process.stdout:
+            if line.startswith('{'):
+                reports.append((time.monotonic(), json.loads(line)))
+
+    threading.Thread(target=read, daemon=True).start()
+    return process
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--users', type=int, default=360000)
+    arguments.add_argument('--rate', type=float, default=300, help='messages per second allowed by the fake Bot API')
+    arguments.add_argument('--workers', type=int, default=32, help='threads of the dispatcher (config.send_workers)')
+    arguments.add_argument('--kill-after', type=float, default=20, help='seconds before the sending process is killed')
+    arguments.add_argument('--timeout', type=float, default=600)
+    arguments.add_argument('--run', nargs=2, metavar=('WORKDIR', 'API_URL'), help=argparse.SUPPRESS)
+    options = arguments.parse_args()
+    if options.run:
+        return run_sender(*options.run, options.rate, options.workers)
+
+    workdir = prepare_workdir(options.users, saved_levels=False)
+    connection = sqlite3.connect(os.path.join(workdir, 'user-table.sqlite3'))
+    expected = {int(chat_id) for chat_id, in connection.execute(
+        'SELECT chat_id FROM users WHERE blood_type = ? AND blood_rh = ? AND bot_stage = 3',
+        (BLOOD_GROUP[:-3], BLOOD_GROUP[-3:]))}
+    api = FakeBotApi(global_rate=int(options.rate)).start()
+
+    def received() -> list:
+        return [(sent_at, int(params['chat_id'])) for sent_at, method, params in list(api.calls)
+                if method == 'sendMessage' and params.get('text') == TEXT]
+
+    reports = []
+    started = time.monotonic()
+    sender = start_sender(workdir, api, options, reports)
+    time.sleep(options.kill_after)
+    sender.send_signal(signal.SIGKILL)
+    sender.wait()
+    sent_before_kill = len(received())
+
+    restarted = time.monotonic()
+    reports_before_restart = len(reports)
+    sender = start_sender(workdir, api, options, reports)
+    sender.wait(options.timeout)
+    finished = time.monotonic()
+    api.stop()
+
+    messages = received()
+    counts = collections.Counter(chat_id for _, chat_id in messages)
+    resumed_times = [sent_at for sent_at, _ in messages if sent_at >= restarted]
+    status, total, sent, lost = connection.execute('SELECT status, total, sent, lost FROM campaigns').fetchone()
+    # the ETA reported after 10 seconds of the resumed run compared with the time it actually took
+    estimate = next(((at, progress) for at, progress in reports[reports_before_restart:]
+                     if at - restarted >= 10 and progress['eta'] is not None), None)
+    report = {'users': options.users, 'recipients': len(expected), 'total': total, 'status': status,
+              'sent_before_kill': sent_before_kill,
+              'delivered': len(counts),
+              'duplicates': sum(count - 1 for count in counts.values() if count > 1),
+              'missing': len(expected - set(counts)),
+              'lost_in_crash': lost,
+              'campaign_sent': sent,
+              'seconds': round(finished - started, 1),
+              'rate_limit': options.rate,
+              'messages_per_s': round(len(resumed_times) / max(resumed_times[-1] - resumed_times[0], 1e-3), 1)
+              if len(resumed_times) > 1 else 0,
+              'eta_s': round(estimate[1]['eta'], 1) if estimate else None,
+              'eta_actual_s': round(finished - estimate[0], 1) if estimate else None,
+              'rejected_with_429': api.rejected}
+    # only the messages being sent when the process was killed (one per dispatcher worker) may be missing
+    report['ok'] = status == 'done' and report['duplicates'] == 0 and report['missing'] <= min(lost, options.workers) \
+        and report['messages_per_s'] >= 0.9 * options.rate
+    print(json.dumps(report, indent=4))
+    sys.exit(0 if report['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Measures the throughput and the tail latency of the outgoing message dispatcher against a fake Bot API
+
+    python benchmarks/bench_dispatcher.py --messages 3000 --chats 1000 --latency 0.05
+"""
+
+import argparse
+import json
+import time
+
+from fake_bot_api import FakeBotApi
+from harness import load_bot, percentiles
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--messages', type=int, default=3000)
+    arguments.add_argument('--chats', type=int, default=1000)
+    arguments.add_argument('--latency', type=float, default=0.05, help='seconds per Bot API call')
+    arguments.add_argument('--workers', type=int, default=8)
+    options = arguments.parse_args()
+
+    api = FakeBotApi(latency=options.latency).start()
+    bot_module = load_bot()
+    bot_module.telebot.apihelper.API_URL = api.api_url
+    dispatcher = bot_module.MessageDispatcher(bot_module.bot, workers=options.workers)
+    dispatcher.start()
+
+    latencies = []
+
+    def record_latency(submitted_at):
+        return lambda future: latencies.append(time.monotonic() - submitted_at)
+
+    started = time.monotonic()
+    futures = []
+    for number in range(options.messages):
+        future = dispatcher.send_message(1000 + number % options.chats, f'#{number}')
+        future.add_done_callback(record_latency(time.monotonic()))
+        futures.append(future)
+    failed = sum(future.exception() is not None for future in futures)
+    elapsed = time.monotonic() - started
+    dispatcher.stop()
+    api.stop()
+
+    print(json.dumps({
+        'messages': options.messages,
+        'chats': options.chats,
+        'workers': options.workers,
+        'elapsed_s': round(elapsed, 3),
+        'messages_per_s': round(options.messages / elapsed, 1),
+        'latency_ms': percentiles(latencies),
+        'failed': failed,
+        'rejected_with_429': api.rejected,
+    }, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Measures how many rows/s the history writer stores into a local SQLite database, one by one and in bulk,
+and how long the /stats queries take over the columnar copy of the whole history (ten years of five banks)
+
+    python benchmarks/bench_history.py --days 3650 --sources 5
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+from harness import load_bot
+
+LEVELS = ['Достатньо', 'Мало', 'Критично']
+
+
+def synthetic_snapshots(bot_module, days: int, sources: int, seed: int = 1) -> list:
+    """(snapshot, source) pairs, one per day and source, going back from today"""
+
+    generator = random.Random(seed)
+    today = datetime.date.today()
+    return [(bot_module.BloodLevels(today - datetime.timedelta(days=day),
+                                    tuple(generator.choice(LEVELS) for _ in bot_module.BLOOD_GROUPS)),
+             f'bank-{source}')
+            for day in range(days) for source in range(sources)]
+
+
+def best_of(function, repeat: int = 20) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return round(min(timings) * 1000, 3)
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--days', type=int, default=3650)
+    arguments.add_argument('--sources', type=int, default=5)
+    arguments.add_argument('--single', type=int, default=500, help='rows written one transaction each')
+    options = arguments.parse_args()
+
+    bot_module = load_bot()
+    from donor_bot.history import DataFrame, HistoryWriter, MysqlDatabase
+
+    database = MysqlDatabase(f'sqlite:///{os.path.join(tempfile.mkdtemp(), "history.db")}')
+    database.create_table()
+    snapshots = synthetic_snapshots(bot_module, options.days, options.sources)
+
+    writer = HistoryWriter(database)
+    started = time.monotonic()
+    for snapshot, source in snapshots[:options.single]:
+        writer.add(snapshot, source)
+        writer.flush()
+    single_elapsed = time.monotonic() - started
+
+    started = time.monotonic()
+    for snapshot, source in snapshots:
+        writer.add(snapshot, source)
+    writer.flush()
+    bulk_elapsed = time.monotonic() - started
+
+    # the second pass overwrites the same dates, the table must not grow
+    rows_in_table = database.Session().query(database.BloodLevelsTable).count()
+
+    # the /stats queries over the memory-mapped arrays, as the bot reads them
+    directory = os.path.join(tempfile.mkdtemp(), 'blood-history')
+    started = time.monotonic()
+    DataFrame.convert_into_data_frame(database).save(directory)
+    convert_elapsed = time.monotonic() - started
+    history = DataFrame.load(directory)
+    today, _ = snapshots[0]
+    queries = {'shortage_streaks': lambda: history.shortage_streaks('bank-0'),
+               'shortage_frequency_weekday': lambda: history.shortage_frequency('bank-0', by='weekday'),
+               'shortage_frequency_month': lambda: history.shortage_frequency('bank-0', by='month'),
+               'days_since_last_shortage': lambda: history.days_since_last_shortage('bank-0'),
+               'with_snapshot': lambda: history.with_snapshot(today._replace(levels=('Мало',) * 8), 'bank-0')}
+
+    print(json.dumps({
+        'single_rows': options.single,
+        'single_rows_per_s': round(options.single / single_elapsed, 1),
+        'bulk_rows': len(snapshots),
+        'bulk_rows_per_s': round(len(snapshots) / bulk_elapsed, 1),
+        'rows_in_table': rows_in_table,
+        'duplicates': rows_in_table - len(snapshots),
+        'history_rows': len(history.days),
+        'convert_and_save_ms': round(convert_elapsed * 1000, 1),
+        'query_ms': {name: best_of(query) for name, query in queries.items()},
+    }, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Benchmarks the hot paths of the bot on synthetic user tables and the fixture pages, no network is needed.
+The results are written as json and compared with the timings of baseline.json: a path more than --tolerance
+slower than its baseline fails the run. The baseline is recorded on the machine running the checks
+
+    python benchmarks/bench_hot_paths.py --sizes 1000,100000 --update-baseline
+    python benchmarks/bench_hot_paths.py --sizes 1000,100000 --output bench-results.json
+    python benchmarks/bench_hot_paths.py --sizes 1000000
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import platform
+import sys
+import time
+from concurrent.futures import Future
+
+from generate_users import synthetic_users
+from harness import load_bot
+
+FIXTURES = pathlib.Path(__file__).resolve().parent / 'fixtures'
+BASELINE = pathlib.Path(__file__).resolve().parent / 'baseline.json'
+NOISE_MS = 0.05  # timer and scheduling noise, the sub-millisecond paths would fail on it alone
+
+
+def best_of(function, repeat: int = 5, setup=None) -> float:
+    """The fastest of `repeat` runs in milliseconds, setup() runs before each run and isn't measured"""
+
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        function(argument) if setup else function()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000
+
+
+def command_message(bot_module, chat_id: int, text: str):
+    return bot_module.telebot.types.Message.de_json({
+        'message_id': 1, 'date': 0, 'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Donor'}, 'text': text})
+
+
+def stub_sends(bot_module) -> list:
+    """Replaces the outgoing messages with already delivered futures, returns the list of the 'sent' messages"""
+
+    sent = []
+
+    def send_message(chat_id, text, **kwargs):
+        sent.append((chat_id, text))
+        future = Future()
+        future.set_result(None)
+        return future
+
+    bot_module.dispatcher.send_message = send_message
+    return sent
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--sizes', default='1000,100000', help='comma separated numbers of users')
+    arguments.add_argument('--output', default='bench-results.json')
+    arguments.add_argument('--tolerance', type=float, default=0.5, help='allowed slowdown, 0.5 is 50%% slower')
+    arguments.add_argument('--update-baseline', action='store_true', help='records the results as the new baseline')
+    options = arguments.parse_args()
+
+    from donor_bot.users import UserTable
+
+    bot_module = load_bot()
+    sent = stub_sends(bot_module)
+    with open(FIXTURES / 'kmck-shortage.html', encoding='utf-8') as page:
+        html = page.read()
+    parser = bot_module.banks.caches[bot_module.DEFAULT_BANK].parser
+    cache = bot_module.banks.caches[bot_module.DEFAULT_BANK]
+    cache.snapshot = parser.extract_blood_levels(html)
+    cache.checked_at = time.time()  # fresh enough for the alerts while the benchmarks run
+
+    results = {'Parser.extract_blood_levels': best_of(lambda: parser.extract_blood_levels(html)),
+               'check_blood_availability': best_of(
+                   lambda: bot_module.check_blood_availability(command_message(bot_module, 1, '/update')), 100)}
+
+    for size in [int(size) for size in options.sizes.split(',')]:
+        users = synthetic_users(size)
+        store = bot_module.UserStore(os.path.join(os.getcwd(), f'users-{size}.sqlite3'))
+        store.save_many(users)
+
+        def fresh_notifier(_=None):
+            """Monday 10:00 for the notifier, so that the due users with a shortage are notified"""
+
+            sent.clear()
+            return bot_module.Notifier(time.strftime('%a'), time.strftime('%H'), UserTable.from_json(users),
+                                       store, bot_module.banks, bot_module.dispatcher)
+
+        due_today = sum(record['notify_date'] == str(datetime.date.today()) for record in users.values())
+        results[f'decide_when_to_notify@{size}'] = best_of(lambda notifier: notifier.decide_when_to_notify(),
+                                                           3, fresh_notifier)
+        print(f'{size} users, {due_today} due today, {len(sent)} notifications sent', file=sys.stderr)
+        notifier = fresh_notifier()
+        cid = next(iter(users))
+        results[f'reschedule_notification@{size}'] = best_of(
+            lambda: notifier.reschedule_notification(cid, notifier.user_table, 7), 20)
+        some_users = list(users)[:1000]
+        results[f'reschedule_group_1000@{size}'] = best_of(
+            lambda: notifier.reschedule_group(some_users, notifier.user_table, 7))
+        results[f'save_to_db@{size}'] = best_of(lambda: store.save(cid, users[cid]), 20)
+
+    machine = {'python': platform.python_version(), 'machine': platform.machine(), 'processor': platform.processor()}
+    if options.update_baseline:
+        baseline = {**machine, 'results': {name: round(milliseconds, 3) for name, milliseconds in results.items()}}
+        with open(BASELINE, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=4)
+    with open(BASELINE) as baseline_file:
+        baseline = json.load(baseline_file)
+    if any(baseline.get(key) != value for key, value in machine.items()):
+        print('The baseline was recorded on another machine or Python, rerun with --update-baseline', file=sys.stderr)
+    report = {**machine, 'tolerance': options.tolerance, 'results': dict()}
+    failed = []
+    for name, milliseconds in results.items():
+        reference = baseline['results'].get(name)
+        limit = None if reference is None else reference * (1 + options.tolerance) + NOISE_MS
+        report['results'][name] = {'ms': round(milliseconds, 3), 'baseline_ms': reference,
+                                   'change': None if reference is None else round(milliseconds / reference - 1, 2),
+                                   'ok': limit is None or milliseconds <= limit}
+        if not report['results'][name]['ok']:
+            failed.append(name)
+    report['failed'] = failed
+    with open(options.output, 'w') as output:
+        json.dump(report, output, indent=4)
+    print(json.dumps(report, indent=4))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+"""End-to-end load test: simulated donors talk to the bot through a local fake Bot API while the blood levels come
+from a local stand-in of kmck.kiev.ua. Every donor goes through the onboarding (a few make a mistake and start
+again), spams /update and presses the buttons of the notification. Reports the end-to-end latency (an update is sent
+-> all its replies have reached the fake API), the throughput, the errors and whether the user table, in memory and
+in the store, ends up holding exactly the donors' answers
+
+    python benchmarks/bench_load.py --donors 2000 --concurrency 200 --mode webhook
+    python benchmarks/bench_load.py --donors 300 --mode polling --telegram-limits
+"""
+
+import argparse
+import collections
+import http.client
+import itertools
+import json
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_startup import prepare_workdir
+from fake_blood_bank import FakeBloodBank
+from fake_bot_api import FakeBotApi
+from harness import TEST_TOKEN, load_bot, percentiles
+
+BLOOD_TYPES = {'I': 'I - перша', 'II': 'II - друга', 'III': 'III - третя', 'IV': 'IV - четверта'}
+LAST_DONATED = {'2+ місяців тому': 60, 'Місяць тому': 30, 'Два тижні тому': 14, 'Тиждень тому': 7}
+POSTPONE = {'add_one_week': 7, 'add_two_months': 60}
+SHORTAGE = ['Достатньо', 'Мало', 'Достатньо', 'Критично', 'Мало', 'Критично', 'Критично', 'Критично']
+ENOUGH = ['Достатньо'] * 8
+FIRST_DONOR = 900000000  # above the chat ids of the synthetic users
+
+
+class Donor:
+    """The answers of a simulated donor, drawn at random, and the user record they should leave behind"""
+
+    def __init__(self, chat_id: int, generator: random.Random, update_spam: int):
+        self.chat_id = chat_id
+        self.blood_type = generator.choice(list(BLOOD_TYPES))
+        self.blood_rh = generator.choice(['(+)', '(-)'])
+        self.last_donated = generator.choice(list(LAST_DONATED))
+        self.mistake = generator.random() < 0.05  # answers the first question wrongly and starts again
+        self.updates = generator.randrange(1, update_spam + 1)
+        self.buttons = [generator.choice(list(POSTPONE)) for _ in range(generator.randrange(1, 3))]
+
+    def expected(self, today: int) -> dict:
+        from donor_bot.users import from_day
+
+        return dict(blood_type=self.blood_type, blood_rh=self.blood_rh,
+                    last_donated=from_day(today - LAST_DONATED[self.last_donated]), bot_stage=3,
+                    notify_date=from_day(today + POSTPONE[self.buttons[-1]]), bank='kmck')
+
+
+def message_update(chat_id: int, text: str) -> dict:
+    message = {'message_id': 1, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'},
+               'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Donor'}, 'text': text}
+    if text.startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+    return {'message': message}
+
+
+def callback_update(chat_id: int, data: str) -> dict:
+    user = {'id': chat_id, 'is_bot': False, 'first_name': 'Donor'}
+    return {'callback_query': {'id': str(chat_id), 'from': user, 'chat_instance': str(chat_id), 'data': data,
+                               'message': {'message_id': 1, 'date': int(time.time()), 'from': user,
+                                           'chat': {'id': chat_id, 'type': 'private'}, 'text': 'Привіт!'}}}
+
+
+class WebhookTransport:
+    """Posts the updates to the webhook like Telegram does, an update refused with 503 or whose connection has
+    failed is delivered again"""
+
+    def __init__(self, port: int, path: str):
+        self.port = port
+        self.path = path
+        self.update_ids = itertools.count(1)
+        self.connections = threading.local()
+        self.redelivered = 0
+
+    def send(self, update: dict):
+        body = json.dumps(dict(update, update_id=next(self.update_ids)))
+        while 1:
+            if not hasattr(self.connections, 'connection'):
+                self.connections.connection = http.client.HTTPConnection('127.0.0.1', self.port)
+            try:
+                self.connections.connection.request('POST', self.path, body, {'Content-Type': 'application/json'})
+                response = self.connections.connection.getresponse()
+                response.read()
+                if response.status != 503:
+                    return
+            except (OSError, http.client.HTTPException):
+                self.connections.connection.close()
+                del self.connections.connection
+            self.redelivered += 1
+            time.sleep(0.1)
+
+
+class PollingTransport:
+    """Queues the updates in the fake Bot API, the bot takes them with getUpdates"""
+
+    def __init__(self, api: FakeBotApi):
+        self.api = api
+        self.redelivered = 0
+
+    def send(self, update: dict):
+        self.api.push_update(update)
+
+
+class LoadTest:
+    """Plays the donors' conversations and checks every reply"""
+
+    def __init__(self, transport, api: FakeBotApi, reply_timeout: float):
+        self.transport = transport
+        self.reply_timeout = reply_timeout
+        self.inboxes = collections.defaultdict(queue.Queue)  # chat id -> (time, text) of the messages sent to it
+        self.latencies = collections.defaultdict(list)  # step -> seconds
+        self.errors = collections.Counter()
+        self.updates = 0
+        api.subscribe(self.receive)
+
+    def receive(self, at: float, method: str, params: dict):
+        if method == 'sendMessage':
+            self.inboxes[int(params['chat_id'])].put((at, params.get('text', '')))
+
+    def step(self, donor: Donor, kind: str, updates: list, replies: int, expected: str) -> list:
+        """Sends the updates and waits for all their replies, the latency is measured till the last one"""
+
+        inbox = self.inboxes[donor.chat_id]
+        started = time.monotonic()
+        for update in updates:
+            self.transport.send(update)
+            self.updates += 1
+        received = []
+        for _ in range(replies):
+            try:
+                received.append(inbox.get(timeout=self.reply_timeout))
+            except queue.Empty:
+                self.errors[f'no_reply_to_{kind}'] += 1
+                return received
+        self.latencies[kind].append(received[-1][0] - started)
+        if not any(expected in text for _, text in received):
+            self.errors[f'unexpected_reply_to_{kind}'] += 1
+        return received
+
+    def play(self, donor: Donor):
+        cid = donor.chat_id
+        self.step(donor, 'start', [message_update(cid, '/start')], 1, 'групу крові')
+        if donor.mistake:
+            self.step(donor, 'wrong_answer', [message_update(cid, 'V - п\'ята')], 2, 'Дурник-бот')
+            self.step(donor, 'start', [message_update(cid, '/start')], 1, 'групу крові')
+        self.step(donor, 'blood_type', [message_update(cid, BLOOD_TYPES[donor.blood_type])], 1, 'резус')
+        self.step(donor, 'blood_rh', [message_update(cid, donor.blood_rh)], 1, 'востаннє')
+        self.step(donor, 'last_donated', [message_update(cid, donor.last_donated)], 1, 'All done')
+        self.step(donor, 'update', [message_update(cid, '/update')] * donor.updates, donor.updates, 'Запаси')
+        for button in donor.buttons:
+            self.step(donor, 'button', [callback_update(cid, button)], 2, 'Відкладаю')
+
+    def leftovers(self) -> int:
+        """Messages nobody has waited for: duplicated replies or notifications sent in the middle of the test"""
+
+        return sum(inbox.qsize() for inbox in self.inboxes.values())
+
+
+def check_user_table(bot, donors: list, users: int) -> dict:
+    """Compares the users in memory and in the store with the donors' answers"""
+
+    from donor_bot.users import today
+
+    stored = bot.user_store.load_all()
+    problems = collections.Counter()
+    for donor in donors:
+        expected = donor.expected(today())
+        for place, table in (('memory', bot.user), ('store', stored)):
+            record = table.get(donor.chat_id)
+            if record is None:
+                problems[f'missing_in_{place}'] += 1
+                continue
+            for field, value in record.to_json().items():
+                if value != expected[field]:
+                    problems[f'{field}_differs_in_{place}'] += 1
+        if bot.onboarding.get(donor.chat_id) is not None:
+            problems['onboarding_not_finished'] += 1
+    if len(bot.user) != users + len(donors):
+        problems['users_in_memory'] = len(bot.user) - users - len(donors)
+    if len(stored) != users + len(donors):
+        problems['users_in_store'] = len(stored) - users - len(donors)
+    return dict(problems)
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--donors', type=int, default=2000)
+    arguments.add_argument('--concurrency', type=int, default=200, help='donors talking to the bot at once')
+    arguments.add_argument('--users', type=int, default=100000, help='users already in the table')
+    arguments.add_argument('--update-spam', type=int, default=5, help='up to so many /update at once per donor')
+    arguments.add_argument('--mode', choices=['webhook', 'polling'], default='webhook')
+    arguments.add_argument('--telegram-limits', action='store_true',
+                           help="enforce Telegram's 30 messages/s and 1 message/s per chat, otherwise the bot's own "
+                                "capacity is measured")
+    arguments.add_argument('--refresh', type=float, default=2, help='seconds between the blood levels refreshes')
+    arguments.add_argument('--reply-timeout', type=float, default=60)
+    arguments.add_argument('--seed', type=int, default=1)
+    options = arguments.parse_args()
+
+    workdir = prepare_workdir(options.users, saved_levels=True)
+    if options.telegram_limits:
+        api = FakeBotApi().start()
+        bot = load_bot(workdir)  # the default rate, under the limit
+    else:
+        api = FakeBotApi(global_rate=10 ** 9, chat_burst=10 ** 9).start()
+        bot = load_bot(workdir, send_rate=10 ** 6, send_workers=16)
+        bot.dispatcher.chat_rate = bot.dispatcher.chat_burst = 10 ** 6
+    bot.telebot.apihelper.API_URL = api.api_url
+
+    # the levels change every few refreshes, so the notifier runs for the new shortages during the test
+    site = FakeBloodBank(SHORTAGE).start()
+    cache = bot.banks.caches['kmck']
+    cache.parser.page_url = site.url
+    cache.ttl = options.refresh
+    stop_flipping = threading.Event()
+
+    def flip_levels():
+        for levels in itertools.cycle([ENOUGH, SHORTAGE]):
+            if stop_flipping.wait(options.refresh * 3):
+                return
+            site.set_levels(levels)
+
+    threading.Thread(target=flip_levels, daemon=True).start()
+    # the notifications would be sent in the middle of the test on Monday 10:00, they are left out
+    bot.notifier.date = 'Sun' if time.strftime('%a') != 'Sun' else 'Sat'
+
+    errors_logged = collections.Counter()
+
+    class CountErrors(logging.Handler):
+        def emit(self, record):
+            errors_logged[record.name] += 1
+
+    logging.getLogger('TeleBot').addHandler(CountErrors(logging.ERROR))
+
+    bot.dispatcher.start()
+    bot.background_processing()
+    if options.mode == 'webhook':
+        bot.bot.threaded = False  # the handlers run in the pool's workers
+        pool = bot.UpdatePool(bot.bot)
+        pool.start()
+        server = bot.WebhookServer(pool, '127.0.0.1', 0, f'/{TEST_TOKEN}')
+        server.start()
+        transport = WebhookTransport(server.port, f'/{TEST_TOKEN}')
+    else:
+        poller = threading.Thread(target=bot.run_polling, kwargs=dict(interval=0, timeout=1), daemon=True)
+        poller.start()
+        transport = PollingTransport(api)
+
+    generator = random.Random(options.seed)
+    donors = [Donor(FIRST_DONOR + number, generator, options.update_spam) for number in range(options.donors)]
+    load = LoadTest(transport, api, options.reply_timeout)
+    failed_sends = bot.metrics.messages_failed.value
+    started = time.monotonic()
+    with ThreadPoolExecutor(options.concurrency) as executor:
+        for future in [executor.submit(load.play, donor) for donor in donors]:
+            if future.exception() is not None:
+                load.errors[f'donor_crashed: {future.exception()}'] += 1
+    elapsed = time.monotonic() - started
+
+    time.sleep(1)  # the replies that come too late or twice
+    if options.mode == 'webhook':
+        server.stop()
+        handler_errors = pool.failed
+    else:
+        bot.bot.stop_polling()
+        poller.join()
+        handler_errors = 0
+    bot.dispatcher.stop()
+    bot.scheduler.stop()
+    bot.refresh_scheduler.stop()
+    stop_flipping.set()
+    site.stop()
+    api.stop()
+
+    replies = sum(len(samples) for samples in load.latencies.values())
+    errors = dict(load.errors, handler_exceptions=handler_errors + sum(errors_logged.values()),
+                  failed_sends=bot.metrics.messages_failed.value - failed_sends, unexpected_messages=load.leftovers())
+    consistency = check_user_table(bot, donors, options.users)
+    report = {'mode': options.mode, 'donors': options.donors, 'concurrency': options.concurrency,
+              'users': options.users, 'telegram_limits': options.telegram_limits,
+              'updates': load.updates, 'steps': replies,
+              'seconds': round(elapsed, 1),
+              'updates_per_s': round(load.updates / elapsed, 1),
+              'messages_per_s': round(len([call for call in api.calls if call[1] == 'sendMessage']) / elapsed, 1),
+              'latency_ms': dict({kind: percentiles(samples) for kind, samples in sorted(load.latencies.items())},
+                                 all=percentiles([sample for samples in load.latencies.values()
+                                                  for sample in samples])),
+              'errors': {name: count for name, count in errors.items() if count},
+              'redelivered_after_503': transport.redelivered,
+              'rejected_with_429': api.rejected,
+              'blood_levels_refreshes': site.requests,
+              'inconsistent_users': consistency}
+    report['ok'] = not report['errors'] and not consistency
+    print(json.dumps(report, indent=4, ensure_ascii=False))
+    sys.exit(0 if report['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
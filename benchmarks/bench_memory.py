@@ -0,0 +1,73 @@
+"""Compares the memory taken by the users loaded from the store as dicts (the old format) and as a UserTable
+
+    python benchmarks/bench_memory.py --users 1000000
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from generate_users import synthetic_users
+from harness import ROOT
+
+
+def measure(load) -> tuple:
+    """Bytes allocated by load() and still held by its result, seconds taken"""
+
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - started
+    held = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, held, elapsed
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--users', type=int, default=1000000)
+    arguments.add_argument('--min-ratio', type=float, default=10, help='exits with 1 below this saving')
+    options = arguments.parse_args()
+
+    sys.path.insert(0, str(ROOT))
+    from donor_bot.store import UserStore
+    from donor_bot.users import today
+
+    store = UserStore(os.path.join(tempfile.mkdtemp(prefix='donor-bot-memory-'), 'user-table.sqlite3'))
+    store.save_many(synthetic_users(options.users))
+
+    def load_dicts() -> dict:
+        rows = store.connection.execute('SELECT chat_id, %s FROM users' % ', '.join(store.fields)).fetchall()
+        return {row[0]: dict(zip(store.fields, row[1:])) for row in rows}
+
+    dicts, dicts_bytes, dicts_seconds = measure(load_dicts)
+    table, table_bytes, table_seconds = measure(store.load_all)
+
+    started = time.perf_counter()
+    due_dicts = sum(record['notify_date'] == str(datetime.date.today()) for record in dicts.values())
+    dicts_scan = time.perf_counter() - started
+    started = time.perf_counter()
+    due_table = sum(len(chat_ids) for chat_ids in table.due(today()).values())
+    table_scan = time.perf_counter() - started
+
+    report = {'users': options.users,
+              'dict_bytes_per_user': round(dicts_bytes / options.users, 1),
+              'table_bytes_per_user': round(table_bytes / options.users, 1),
+              'ratio': round(dicts_bytes / table_bytes, 1),
+              'dict_load_s': round(dicts_seconds, 3), 'table_load_s': round(table_seconds, 3),
+              'due_today_scan_ms': {'dicts': round(dicts_scan * 1000, 1), 'table': round(table_scan * 1000, 1)},
+              'due_today': {'dicts': due_dicts, 'table': due_table}}
+    report['ok'] = report['ratio'] >= options.min_ratio
+    print(json.dumps(report, indent=4))
+    sys.exit(0 if report['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
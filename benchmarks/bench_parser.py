@@ -0,0 +1,115 @@
+"""Compares the streaming lxml extraction of the blood levels with the former BeautifulSoup path on the synthetic
+fixture pages: parse time, peak memory (Python heap and process RSS) and the result on a page with one more h4
+before the block.
+The BeautifulSoup path needs `pip install beautifulsoup4`
+
+    python benchmarks/bench_parser.py
+"""
+
+import argparse
+import json
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from harness import ROOT
+
+FIXTURES = pathlib.Path(__file__).resolve().parent / 'fixtures'
+# the news list under the blood levels on a busy day, the streaming path stops before it
+NEWS = b''.join(b'<article><h2>News %d</h2><p>%s</p></article>' % (number, b'text ' * 200) for number in range(2000))
+
+
+def beautifulsoup_levels(page: bytes) -> tuple:
+    """The former extraction: the first eight h4 strings of the whole parsed page, in document order"""
+
+    from bs4 import BeautifulSoup
+
+    return tuple(item.string for item in BeautifulSoup(page, 'lxml').find_all('h4'))[:8]
+
+
+def streaming_levels(page: bytes) -> tuple:
+    from donor_bot.parser import Parser
+
+    parser = Parser('http://kmck.kiev.ua/', 'h4')
+    chunks = (page[start:start + parser.chunk_size] for start in range(0, len(page), parser.chunk_size))
+    return parser.extract_blood_levels(chunks).levels
+
+
+PATHS = {'beautifulsoup': beautifulsoup_levels, 'streaming': streaming_levels}
+
+
+def best_of(function, page: bytes, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(page)
+        timings.append(time.perf_counter() - started)
+    return round(min(timings) * 1000, 3)
+
+
+def peak_rss() -> int:
+    """VmHWM of the process in KiB, unlike ru_maxrss it isn't inherited from the parent through fork and exec"""
+
+    with open('/proc/self/status') as status:
+        return next(int(line.split()[1]) for line in status if line.startswith('VmHWM:'))
+
+
+def measure_rss(path: str, page_path: str):
+    """Runs inside a fresh process: the growth of the peak RSS caused by one extraction, in KiB"""
+
+    function = PATHS[path]
+    page = pathlib.Path(page_path).read_bytes()
+    # the modules are loaded before the measurement
+    if path == 'beautifulsoup':
+        from bs4 import BeautifulSoup
+        BeautifulSoup(b'<p></p>', 'lxml')
+    else:
+        import donor_bot.parser  # noqa: F401
+    before = peak_rss()
+    function(page)
+    print(peak_rss() - before)
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--repeat', type=int, default=50)
+    arguments.add_argument('--rss', nargs=2, metavar=('PATH', 'PAGE'), help=argparse.SUPPRESS)
+    options = arguments.parse_args()
+    sys.path.insert(0, str(ROOT))
+    if options.rss:
+        return measure_rss(*options.rss)
+
+    pages = sorted(FIXTURES.glob('*.html'))
+    padded = pathlib.Path(tempfile.mkdtemp(prefix='donor-bot-parser-')) / 'kmck-shortage+news.html'
+    padded.write_bytes((FIXTURES / 'kmck-shortage.html').read_bytes().replace(b'</body>', NEWS + b'</body>', 1))
+    pages.append(padded)
+
+    report = dict()
+    for page_path in pages:
+        page = page_path.read_bytes()
+        results = dict()
+        for path, function in PATHS.items():
+            function(page)  # imports and warms up
+            tracemalloc.start()
+            function(page)
+            heap_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rss = subprocess.run([sys.executable, __file__, '--rss', path, str(page_path)],
+                                 capture_output=True, text=True, check=True).stdout.strip()
+            results[path] = {'ms': best_of(function, page, options.repeat),
+                             'heap_peak_kib': round(heap_peak / 1024, 1), 'rss_growth_kib': int(rss)}
+        results['speedup'] = round(results['beautifulsoup']['ms'] / results['streaming']['ms'], 1)
+        report[page_path.name] = dict(results, kib=len(page) // 1024)
+
+    # one more h4 before the block (e.g. a news heading) shifts the former path by one blood group
+    page = (FIXTURES / 'kmck-shortage.html').read_bytes().replace(
+        b'<section class="blood-levels">', '<h4>Увага донорам</h4><section class="blood-levels">'.encode(), 1)
+    report['extra_h4'] = {path: list(function(page)) for path, function in PATHS.items()}
+    print(json.dumps(report, indent=4, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
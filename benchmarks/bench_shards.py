@@ -0,0 +1,121 @@
+"""Runs several notification worker processes against a local fake Bot API, kills one of them in the middle of
+the Monday run and checks that its shards are taken over and that nobody gets the alert twice
+
+    python benchmarks/bench_shards.py --users 60000 --workers 3 --shards 8
+"""
+
+import argparse
+import collections
+import json
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import time
+
+from bench_startup import prepare_workdir
+from fake_bot_api import FakeBotApi
+from harness import load_bot
+
+REFUSED_URL = 'http://127.0.0.1:9/'  # the page refreshes fail at once, the saved blood levels are used
+
+
+def run_worker(workdir: str, api_url: str, shards: int, lease: float, worker_id: str):
+    """Runs inside a worker process until it is killed"""
+
+    bot = load_bot(workdir, notify_shards=shards)
+    from donor_bot import worker
+
+    bot.telebot.apihelper.API_URL = api_url
+    for cache in bot.banks.caches.values():
+        cache.parser.page_url = REFUSED_URL
+    # the run at the start of the worker sends the notifications as if it was Monday 10:00
+    bot.notifier.date, bot.notifier.time = time.strftime('%a'), time.strftime('%H')
+    worker.start(lease=lease, worker_id=worker_id)
+    signal.pause()
+
+
+def expected_recipients(workdir: str) -> set:
+    """The users due today whose blood group is short in the saved blood levels"""
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from donor_bot.parser import BankRegistry, BloodBank, Parser
+    from donor_bot.store import UserStore
+    from donor_bot.users import today
+
+    registry = BankRegistry()
+    registry.register(BloodBank('kmck', 'kmck', (0, 0)), Parser(REFUSED_URL, 'h4'))
+    registry.load_snapshots(os.path.join(workdir, 'blood-levels.json'))
+    users = UserStore(os.path.join(workdir, 'user-table.sqlite3')).load_all()
+    return {str(cid) for (bank_id, group), cids in users.due(today()).items()
+            if registry.snapshot(bank_id).is_low(group) for cid in cids}
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--users', type=int, default=60000)
+    arguments.add_argument('--workers', type=int, default=3)
+    arguments.add_argument('--shards', type=int, default=8)
+    arguments.add_argument('--lease', type=float, default=3, help='seconds, short so that the takeover is quick')
+    arguments.add_argument('--kill-after', type=float, default=4, help='seconds before the first worker is killed')
+    arguments.add_argument('--timeout', type=float, default=120)
+    arguments.add_argument('--worker', nargs=3, metavar=('WORKDIR', 'API_URL', 'WORKER_ID'), help=argparse.SUPPRESS)
+    options = arguments.parse_args()
+    if options.worker:
+        return run_worker(options.worker[0], options.worker[1], options.shards, options.lease, options.worker[2])
+
+    workdir = prepare_workdir(options.users, saved_levels=True)
+    expected = expected_recipients(workdir)
+    api = FakeBotApi().start()
+    started = time.monotonic()
+    workers = [subprocess.Popen([sys.executable, __file__, '--shards', str(options.shards),
+                                 '--lease', str(options.lease), '--worker', workdir, api.api_url, f'worker-{number}'],
+                                stdout=subprocess.DEVNULL)
+               for number in range(options.workers)]
+
+    def alerts() -> collections.Counter:
+        return collections.Counter(str(params['chat_id']) for params in api.sent_messages()
+                                   if 'add_one_week' in str(params.get('reply_markup')))
+
+    def lost_in_crash() -> set:
+        """Claimed by the killed worker but never sent: the price of sending at most once"""
+
+        connection = sqlite3.connect(os.path.join(workdir, 'user-table.sqlite3'))
+        claimed = {chat_id for chat_id, in connection.execute(
+            'SELECT chat_id FROM notification_sent WHERE worker_id = ?', ('worker-0',))}
+        connection.close()
+        return claimed - set(alerts())
+
+    time.sleep(options.kill_after)
+    workers[0].send_signal(signal.SIGKILL)
+    sent_before_kill = sum(alerts().values())
+    while time.monotonic() - started < options.timeout:
+        time.sleep(1)
+        if set(alerts()) | lost_in_crash() >= expected:
+            break
+    elapsed = time.monotonic() - started
+    for process in workers[1:]:
+        process.terminate()
+    for process in workers:
+        process.wait()
+    api.stop()
+
+    received = alerts()
+    report = {'users': options.users, 'workers': options.workers, 'shards': options.shards,
+              'expected_alerts': len(expected),
+              'alerts_before_kill': sent_before_kill,
+              'alerts': sum(received.values()),
+              'duplicates': sum(count - 1 for count in received.values() if count > 1),
+              'missing': len(expected - set(received)),
+              'lost_in_crash': len(lost_in_crash()),
+              'seconds': round(elapsed, 1),
+              'alerts_per_s': round(sum(received.values()) / elapsed, 1),
+              'rejected_with_429': api.rejected}
+    report['ok'] = report['duplicates'] == 0 and report['missing'] <= report['lost_in_crash']
+    print(json.dumps(report, indent=4))
+    sys.exit(0 if report['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""Measures the cold start of the bot: a fresh process imports the package, loads the users and the saved blood
+levels and answers /update while the blood bank site is unreachable. The start must fit into the budget
+of thresholds.json ('cold_start@<users>', milliseconds of the whole process, interpreter included)
+
+    python benchmarks/bench_startup.py --users 100000
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+from generate_users import synthetic_users
+from harness import ROOT
+
+FIXTURES = pathlib.Path(__file__).resolve().parent / 'fixtures'
+THRESHOLDS = pathlib.Path(__file__).resolve().parent / 'thresholds.json'
+# nothing listens there and the packets are dropped, a download hangs until its timeout
+UNREACHABLE_URL = 'http://10.255.255.1/'
+
+
+def prepare_workdir(users: int, saved_levels: bool) -> str:
+    """A working directory left by a previous run: the user table and, optionally, the saved blood levels"""
+
+    sys.path.insert(0, str(ROOT))
+    from donor_bot.parser import Parser
+    from donor_bot.store import UserStore
+
+    workdir = tempfile.mkdtemp(prefix='donor-bot-startup-')
+    UserStore(os.path.join(workdir, 'user-table.sqlite3')).save_many(synthetic_users(users))
+    if saved_levels:
+        with open(FIXTURES / 'kmck-shortage.html', encoding='utf-8') as page:
+            snapshot = Parser('http://kmck.kiev.ua/', 'h4').extract_blood_levels(page.read())
+        with open(os.path.join(workdir, 'blood-levels.json'), 'w') as json_file:
+            json.dump({snapshot.source: {'date': str(snapshot.date), 'levels': snapshot.levels,
+                                         'etag': None, 'last_modified': None, 'checked_at': time.time()}},
+                      json_file, ensure_ascii=False)
+    return workdir
+
+
+def start(workdir: str):
+    """Runs inside the measured process, prints the timings of the start as json"""
+
+    started = time.perf_counter()
+    from donor_bot import bot
+    imported = time.perf_counter()
+
+    from harness import load_bot
+    load_bot(workdir)
+    initialized = time.perf_counter()
+    for cache in bot.banks.caches.values():
+        cache.parser.page_url = UNREACHABLE_URL
+        cache.parser.timeout = 5
+    replies = []
+    bot.dispatcher.send_message = lambda chat_id, text, **kwargs: replies.append(text)
+    bot.background_processing()  # the first refresh hangs in the scheduler's thread
+    bot.check_blood_availability(bot.telebot.types.Message.de_json({
+        'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'},
+        'from': {'id': 1, 'is_bot': False, 'first_name': 'Donor'}, 'text': '/update'}))
+    answered = time.perf_counter()
+    print(json.dumps({'import_ms': round((imported - started) * 1000, 1),
+                      'init_ms': round((initialized - imported) * 1000, 1),
+                      'first_reply_ms': round((answered - initialized) * 1000, 1),
+                      'users': len(bot.user),
+                      'answered': bool(replies),
+                      'reply': replies[0].splitlines()[0] if replies else None}))
+    sys.stdout.flush()
+    os._exit(0)  # the refresh is still waiting for the site, nothing has to be cleaned up
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--users', type=int, default=100000)
+    arguments.add_argument('--runs', type=int, default=3, help='the fastest run is compared with the budget')
+    arguments.add_argument('--start', metavar='WORKDIR', help=argparse.SUPPRESS)
+    options = arguments.parse_args()
+    if options.start:
+        return start(options.start)
+
+    results = dict()
+    for saved_levels in (True, False):
+        workdir = prepare_workdir(options.users, saved_levels)
+        runs = []
+        for _ in range(options.runs):
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, __file__, '--start', workdir],
+                                    capture_output=True, text=True, timeout=120)
+            elapsed = time.perf_counter() - started
+            if output.returncode != 0:
+                runs.append({'total_ms': round(elapsed * 1000, 1), 'answered': False,
+                             'error': output.stderr.strip().splitlines()[-1:]})
+            else:
+                runs.append(dict(json.loads(output.stdout.strip().splitlines()[-1]),
+                                 total_ms=round(elapsed * 1000, 1)))
+        results['saved_levels' if saved_levels else 'no_saved_levels'] = min(runs, key=lambda run: run['total_ms'])
+
+    with open(THRESHOLDS) as json_file:
+        budget = json.load(json_file).get(f'cold_start@{options.users}')
+    warm = results['saved_levels']
+    results['budget_ms'] = budget
+    results['ok'] = warm['answered'] and (budget is None or warm['total_ms'] <= budget)
+    print(json.dumps(results, indent=4, ensure_ascii=False))
+    sys.exit(0 if results['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
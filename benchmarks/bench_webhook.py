@@ -0,0 +1,97 @@
+"""Replays updates against the webhook server and measures the throughput and the handler latency
+
+    python benchmarks/bench_webhook.py --updates 5000 --chats 500
+    python benchmarks/bench_webhook.py --replay recorded-updates.json
+"""
+
+import argparse
+import datetime
+import http.client
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_bot_api import FakeBotApi
+from harness import TEST_TOKEN, load_bot, percentiles
+
+COMMANDS = ['/help', '/info', '/intervals', '/update', '/location']
+
+
+def synthetic_updates(count: int, chats: int) -> list:
+    """Command messages spread over the chats, the same shape Telegram pushes to the webhook"""
+
+    updates = []
+    for number in range(count):
+        chat_id = 1000 + number % chats
+        updates.append({'update_id': number + 1, 'message': {
+            'message_id': number + 1, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Donor'},
+            'text': COMMANDS[number % len(COMMANDS)],
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(COMMANDS[number % len(COMMANDS)])}]}})
+    return updates
+
+
+def post_all(port: int, path: str, bodies: list) -> int:
+    """Posts the updates over one keep-alive connection, returns how many were refused with 503"""
+
+    refused = 0
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    for body in bodies:
+        connection.request('POST', path, body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        response.read()
+        refused += response.status == 503
+    connection.close()
+    return refused
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--updates', type=int, default=5000)
+    arguments.add_argument('--chats', type=int, default=500)
+    arguments.add_argument('--replay', help='json file with a list of recorded updates')
+    arguments.add_argument('--senders', type=int, default=4, help='concurrent connections posting the updates')
+    options = arguments.parse_args()
+
+    if options.replay:
+        with open(options.replay) as replay_file:
+            updates = json.load(replay_file)
+    else:
+        updates = synthetic_updates(options.updates, options.chats)
+    bodies = [json.dumps(update) for update in updates]
+
+    # the replies are sent to the fake Bot API without rate limits, only the handling itself is measured
+    api = FakeBotApi(global_rate=10 ** 9, chat_burst=10 ** 9).start()
+    bot_module = load_bot()
+    bot_module.telebot.apihelper.API_URL = api.api_url
+    cache = bot_module.banks.caches[bot_module.DEFAULT_BANK]
+    cache.snapshot = bot_module.BloodLevels(datetime.date.today(), ('Достатньо',) * 8)
+    bot_module.bot.threaded = False
+    bot_module.dispatcher.start()
+    pool = bot_module.UpdatePool(bot_module.bot)
+    pool.start()
+    server = bot_module.WebhookServer(pool, '127.0.0.1', 0, f'/{TEST_TOKEN}')
+    server.start()
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(options.senders) as senders:
+        refused = sum(senders.map(lambda part: post_all(server.port, f'/{TEST_TOKEN}', part),
+                                  [bodies[number::options.senders] for number in range(options.senders)]))
+    server.stop()  # drains the pool
+    elapsed = time.monotonic() - started
+    bot_module.dispatcher.stop()
+    api.stop()
+
+    print(json.dumps({
+        'updates': len(bodies),
+        'processed': pool.processed,
+        'refused_with_503': refused,
+        'elapsed_s': round(elapsed, 3),
+        'updates_per_s': round(pool.processed / elapsed, 1),
+        'handler_latency_ms': percentiles(list(pool.latencies)),
+    }, indent=4))
+
+
+if __name__ == '__main__':
+    main()
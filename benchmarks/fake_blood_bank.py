@@ -0,0 +1,71 @@
+"""Local stand-in for a blood bank's site (kmck.kiev.ua), serves a page with the blood levels"""
+
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LABELS = ['I (+)', 'II (+)', 'III (+)', 'IV (+)', 'I (–)', 'II (–)', 'III (–)', 'IV (–)']
+
+
+def render_page(levels: list) -> str:
+    """A page shaped like the blood bank's one: a labelled block per blood group, the level is in an h4"""
+
+    blocks = ''.join(f'<div class="blood-item"><span class="blood-type">{label}</span><h4>{level}</h4></div>'
+                     for label, level in zip(LABELS, levels))
+    return f'<html><head><title>Банк крові</title></head><body><div class="blood-levels">{blocks}</div></body></html>'
+
+
+class FakeBloodBank:
+    """Serves the page with an ETag and answers the conditional requests with 304 while the page is unchanged"""
+
+    def __init__(self, levels: list = None, latency: float = 0.0, html: str = None):
+        self.latency = latency
+        self.requests = 0
+        self.not_modified = 0
+        self.set_page(html or render_page(levels or ['Достатньо'] * 8))
+        self.server = None
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_address[1]}/'
+
+    def set_page(self, html: str):
+        self.page = html.encode('utf-8')
+        self.etag = '"%s"' % hashlib.md5(self.page).hexdigest()
+
+    def set_levels(self, levels: list):
+        self.set_page(render_page(levels))
+
+    def start(self):
+        site = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                site.requests += 1
+                if site.latency:
+                    time.sleep(site.latency)
+                if self.headers.get('If-None-Match') == site.etag:
+                    site.not_modified += 1
+                    self.send_response(304)
+                    self.send_header('ETag', site.etag)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(site.page)))
+                self.send_header('ETag', site.etag)
+                self.end_headers()
+                self.wfile.write(site.page)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
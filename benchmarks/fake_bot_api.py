@@ -0,0 +1,135 @@
+"""Local stand-in for api.telegram.org, answers the bot API methods and enforces Telegram-like rate limits"""
+
+import collections
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeBotApi:
+    """Records every call, answers with 429 when the global or per-chat rate limit is exceeded"""
+
+    def __init__(self, latency: float = 0.0, global_rate: int = 30, chat_rate: int = 1, chat_burst: int = 3):
+        self.latency = latency  # seconds added to every answer, emulates the network round trip
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.calls = []  # (time.monotonic(), method, params)
+        self.rejected = 0
+        self.updates = collections.deque()  # served to getUpdates, see push_update()
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.recent = collections.deque()  # send times of the last second
+        self.recent_by_chat = collections.defaultdict(collections.deque)
+        self.lock = threading.Lock()
+        self.has_updates = threading.Condition(self.lock)  # getUpdates with a timeout waits for it (long polling)
+        self.listeners = []  # called with (time.monotonic(), method, params) of every accepted call
+        self.server = None
+
+    @property
+    def api_url(self) -> str:
+        """Format string for telebot.apihelper.API_URL"""
+
+        return f'http://127.0.0.1:{self.server.server_address[1]}/bot{{0}}/{{1}}'
+
+    def push_update(self, update: dict) -> dict:
+        update = dict(update, update_id=next(self.update_ids))
+        with self.lock:
+            self.updates.append(update)
+            self.has_updates.notify_all()
+        return update
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def sent_messages(self) -> list:
+        return [params for _, method, params in self.calls if method in ('sendMessage', 'sendLocation')]
+
+    def is_rate_limited(self, chat_id, now: float) -> bool:
+        for sent in [self.recent, self.recent_by_chat[chat_id]]:
+            while sent and now - sent[0] >= 1:
+                sent.popleft()
+        if len(self.recent) >= self.global_rate or len(self.recent_by_chat[chat_id]) >= self.chat_burst:
+            return True
+        self.recent.append(now)
+        self.recent_by_chat[chat_id].append(now)
+        return False
+
+    def answer(self, method: str, params: dict):
+        """Returns the status code and the json body of the answer"""
+
+        now = time.monotonic()
+        with self.lock:
+            if method == 'getUpdates':
+                offset = int(params.get('offset') or 0)
+                while self.updates and self.updates[0]['update_id'] < offset:
+                    self.updates.popleft()
+                if not self.updates:
+                    self.has_updates.wait(float(params.get('timeout') or 0))
+                return 200, {'ok': True, 'result': list(self.updates)[:100]}
+            if method in ('sendMessage', 'sendLocation') and self.is_rate_limited(params.get('chat_id'), now):
+                self.rejected += 1
+                return 429, {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                             'parameters': {'retry_after': 1}}
+            self.calls.append((now, method, params))
+        for callback in self.listeners:
+            callback(now, method, params)
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'donor_notify_bot',
+                                                'username': 'donor_notify_bot'}}
+        if method in ('sendMessage', 'sendLocation', 'editMessageText'):
+            chat_id = int(params.get('chat_id') or 0)
+            return 200, {'ok': True, 'result': {'message_id': next(self.message_ids), 'date': int(time.time()),
+                                                'chat': {'id': chat_id, 'type': 'private'},
+                                                'text': params.get('text', '')}}
+        return 200, {'ok': True, 'result': True}
+
+    def start(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, as api.telegram.org
+            disable_nagle_algorithm = True  # the headers and the body are written separately
+
+            def log_message(self, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    pass  # the client process was killed with its keep-alive connections open
+
+            def handle_one(self):
+                url = urlsplit(self.path)
+                params = dict(parse_qsl(url.query))
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    body = self.rfile.read(length).decode()
+                    if self.headers.get('Content-Type', '').startswith('application/json'):
+                        params.update(json.loads(body))
+                    else:
+                        params.update(parse_qsl(body))
+                if api.latency:
+                    time.sleep(api.latency)
+                status, answer = api.answer(url.path.rsplit('/', 1)[-1], params)
+                payload = json.dumps(answer).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = handle_one
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
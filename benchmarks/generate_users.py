@@ -0,0 +1,47 @@
+"""Generates synthetic user tables in the user-table.json format
+
+    python benchmarks/generate_users.py --users 100000 --output /tmp/user-table-100k.json
+"""
+
+import argparse
+import datetime
+import json
+import random
+
+# approximate shares of the blood groups among the Ukrainian donors
+BLOOD_GROUP_SHARES = {('I', '(+)'): 0.28, ('II', '(+)'): 0.32, ('III', '(+)'): 0.15, ('IV', '(+)'): 0.07,
+                      ('I', '(-)'): 0.06, ('II', '(-)'): 0.07, ('III', '(-)'): 0.03, ('IV', '(-)'): 0.02}
+
+
+def synthetic_users(count: int, seed: int = 1, today: datetime.date = None) -> dict:
+    """Users who have finished the onboarding, the notify dates are spread over the next 60 days
+    (about 1/60 of the users are due today), a few users are still in the middle of the onboarding"""
+
+    generator = random.Random(seed)
+    today = today or datetime.date.today()
+    groups, weights = zip(*BLOOD_GROUP_SHARES.items())
+    users = dict()
+    for number in range(count):
+        blood_type, blood_rh = generator.choices(groups, weights)[0]
+        notify_date = today + datetime.timedelta(days=generator.randrange(60))
+        record = dict(blood_type=blood_type, blood_rh=blood_rh,
+                      last_donated=str(notify_date - datetime.timedelta(days=60)),
+                      bot_stage=3, notify_date=str(notify_date))
+        if generator.random() < 0.01:
+            record.update(blood_type=None, blood_rh=None, last_donated=None, bot_stage=0, notify_date=None)
+        users[str(100000000 + number)] = record
+    return users
+
+
+def main():
+    arguments = argparse.ArgumentParser(description=__doc__)
+    arguments.add_argument('--users', type=int, default=1000)
+    arguments.add_argument('--seed', type=int, default=1)
+    arguments.add_argument('--output', default='user-table.json')
+    options = arguments.parse_args()
+    with open(options.output, 'w') as json_file:
+        json.dump(synthetic_users(options.users, options.seed), json_file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Helpers shared by the benchmark scripts: loads the bot without starting it and summarizes the timings"""
+
+import os
+import pathlib
+import sys
+import tempfile
+import types
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+TEST_TOKEN = '123456:local-benchmark-token'
+
+
+sys.path.insert(0, str(ROOT))
+
+
+def load_bot(workdir: str = None, **settings):
+    """Initializes the donor_bot.bot module, the polling loop and the background threads are not started.
+    The bot works inside a temporary directory, so the real user table is never touched.
+    The settings are added to the config, e.g. notify_shards=4"""
+
+    from donor_bot import bot
+
+    os.chdir(workdir or tempfile.mkdtemp(prefix='donor-bot-bench-'))
+    # the benchmarks never talk to the real Telegram, so the secret config is not needed
+    bot.init(types.SimpleNamespace(token=TEST_TOKEN, db_credentials='sqlite://', **settings))
+    return bot
+
+
+def percentiles(samples: list, points=(50, 90, 99)) -> dict:
+    """Returns the requested percentiles of the samples (seconds) in milliseconds"""
+
+    if not samples:
+        return {f'p{point}': None for point in points}
+    ordered = sorted(samples)
+    return {f'p{point}': round(ordered[min(len(ordered) - 1, int(len(ordered) * point / 100))] * 1000, 3)
+            for point in points}
@@ -0,0 +1 @@
+"""@donor_notify_bot notifies the blood donors when the blood bank runs short of their blood group"""
@@ -0,0 +1,3 @@
+from donor_bot.bot import main
+
+main()
@@ -0,0 +1,646 @@
+"""@donor_notify_bot: the Telegram handlers and the wiring of the bot's parts.
+Importing the module has no side effects, init() creates the bot from the files in the working directory"""
+
+import datetime
+import html
+import os
+import signal
+import threading
+import time
+
+import telebot
+
+from donor_bot.campaigns import Campaigns
+from donor_bot.dispatcher import MessageDispatcher
+from donor_bot.levels import BLOOD_GROUPS, DEFAULT_BANK, ENOUGH, BloodLevels
+from donor_bot.metrics import MetricsServer, SamplingProfiler, metrics
+from donor_bot.notifier import Notifier
+from donor_bot.parser import BankRegistry, BloodBank, NoSnapshotError, Parser, StructureDriftError, blood_group_of
+from donor_bot.scheduler import EventScheduler
+from donor_bot.store import Onboarding, UserStore
+from donor_bot.users import today
+from donor_bot.webhook import UpdatePool, WebhookServer
+
+# The latest blood levels of every bank, the next start serves them until the pages are refreshed
+SNAPSHOTS_PATH = 'blood-levels.json'
+# The columnar blood levels history used by /stats, a row per day and bank is added as the pages are refreshed
+HISTORY_PATH = 'blood-history'
+
+# Created by init()
+config = None
+bot = None
+banks = None
+user_store = None
+user = None  # UserTable of the users who have finished the onboarding at least once
+onboarding = None
+notifier = None
+dispatcher = None
+replies = None
+scheduler = None
+refresh_scheduler = None
+campaigns = None
+campaign_reports = dict()  # campaign id -> Future of the admin's progress message, edited by the next reports
+history = None  # loaded by the first /stats
+
+
+def init(settings=None):
+    """Creates the bot and its parts, settings default to the config module.
+    Nothing is downloaded here: the blood levels saved by the previous run are served until the first refresh"""
+
+    global config, bot, banks, user_store, user, onboarding, notifier, dispatcher, replies, scheduler, refresh_scheduler
+    global campaigns
+    if settings is None:
+        import config as settings
+    config = settings
+
+    # the updates sent while the bot was down are answered too: skip_pending stays off
+    bot = telebot.TeleBot(config.token, threaded=True, num_threads=2)
+    register_handlers(bot)
+
+    # Parses the pages and keeps the snapshots of the blood levels fresh, the pages are checked every 10 minutes.
+    # A blood bank from another city is added with one more register() call and its own Parser (sub)class
+    banks = BankRegistry()
+    banks.register(BloodBank(DEFAULT_BANK, 'Київського Центру Крові', (50.475870, 30.441694)),
+                   Parser('http://kmck.kiev.ua/', 'h4'), ttl=600)
+    banks.load_snapshots(SNAPSHOTS_PATH)
+    for cache in banks.caches.values():
+        cache.subscribe(lambda snapshot: banks.save_snapshots(SNAPSHOTS_PATH))
+        cache.subscribe_drift(alert_admins)
+
+    # Part responsible for the communication with MySQL database (any SQLAlchemy url works, e.g. sqlite:///history.db)
+    # from donor_bot.history import DataFrame, HistoryWriter, MysqlDatabase
+    # mysqldb = MysqlDatabase(config.db_credentials)
+    # mysqldb.create_table()
+    # history_writer = HistoryWriter(mysqldb)
+    # for cache in banks.caches.values():
+    #     cache.subscribe(history_writer.write)  # saves every newly parsed snapshot
+    # DataFrame.convert_into_data_frame(mysqldb).save(HISTORY_PATH)  # seeds /stats with the whole stored history
+
+    user_store = UserStore('user-table.sqlite3')
+    user_store.migrate_from_json('user-table.json')
+    user = user_store.load_all()
+    onboarding = Onboarding(user_store)
+
+    # All the outgoing messages go through the dispatcher's worker pool, 25 messages/s stay under Telegram's limit
+    # of 30. config.send_rate raises it for a bot allowed to send more (e.g. paid broadcasts), set it a little under
+    # the allowed rate since Telegram counts the arrivals. config.send_workers keeps up with a higher rate.
+    # With config.notify_shards = N the rate is split into N + 1 shares: the bot process keeps one for the replies,
+    # the workers get the others in proportion to the shards they hold (donor_bot.worker)
+    shares = getattr(config, 'notify_shards', 0) + 1
+    dispatcher = MessageDispatcher(bot, workers=getattr(config, 'send_workers', 8),
+                                   global_rate=getattr(config, 'send_rate', 25) / shares)
+
+    # Turns on the notifications with specific parameters
+    notifier = Notifier('Mon', '10', user, user_store, banks, dispatcher)
+
+    # Admins' broadcasts to the donors of a blood group, resumed by main() after a restart
+    campaigns = Campaigns(user_store, dispatcher)
+    campaigns.subscribe(report_campaign)
+
+    # Pre-rendered /update replies, shared with the inline mode
+    replies = BloodLevelsReplies(banks)
+
+    # The notifier runs and the other background work are done by the scheduler's thread. The pages are refreshed
+    # by a scheduler of their own, so the Monday run waiting for its messages doesn't let the snapshots go stale
+    scheduler = EventScheduler()
+    refresh_scheduler = EventScheduler()
+
+    metrics.gauge('donor_bot_users', 'Users who have finished the onboarding', lambda: len(user))
+    metrics.gauge('donor_bot_send_queue_depth', 'Messages waiting in the dispatcher', dispatcher.queue_depth)
+    metrics.gauge('donor_bot_stale_banks', 'Banks served from a snapshot that has missed more than one refresh',
+                  lambda: sum(cache.is_stale() for cache in banks.caches.values()))
+
+
+def load_history():
+    """The history used by /stats, memory-mapped from the arrays saved by DataFrame.save().
+    numpy is only imported once the statistics are asked for"""
+
+    global history
+    if history is None and os.path.isdir(HISTORY_PATH):
+        from donor_bot.history import DataFrame
+        history = DataFrame.load(HISTORY_PATH)
+    return history
+
+
+def record_history(snapshots: dict):
+    """Adds the refreshed blood levels (bank id -> snapshot) to the /stats history,
+    it is saved only when a bank's levels of the day have changed"""
+
+    global history
+    from donor_bot.history import DataFrame
+
+    updated = load_history() or DataFrame.empty()
+    for bank_id, snapshot in snapshots.items():
+        if snapshot is not None:
+            updated = updated.with_snapshot(snapshot, bank_id)
+    if updated is not history:
+        updated.save(HISTORY_PATH)
+        history = updated
+
+
+def render_blood_levels(snapshot: BloodLevels, bank: BloodBank) -> str:
+    """Formats the blood levels as a single HTML message, the groups with a shortage are emphasized"""
+
+    lines = [f'<b>Запаси {html.escape(bank.name)} станом на {snapshot.date.strftime("%d.%m.%Y")}</b>', '']
+    for number, (blood_group, level) in enumerate(zip(BLOOD_GROUPS, snapshot.levels)):
+        if number == 4:
+            lines.append('')  # Rh- groups are separated from the Rh+ ones
+        label = blood_group.replace('(', ' (').replace('-', '–')
+        if level == ENOUGH:
+            lines.append(f'{label} : {html.escape(level)}')
+        else:
+            lines.append(f'<b>{label} : {html.escape(level)}</b> \u2757')
+    return '\n'.join(lines)
+
+
+class BloodLevelsReplies:
+    """The /update reply of each bank is rendered once per snapshot and reused until the snapshot changes"""
+
+    def __init__(self, registry: BankRegistry):
+        self.banks = registry
+        self.rendered = dict()  # bank id -> (snapshot, text)
+
+    def reply_for(self, bank_id: str) -> str:
+        snapshot = self.banks.snapshot(bank_id)
+        cached = self.rendered.get(bank_id)
+        if cached is None or cached[0] is not snapshot:
+            cached = (snapshot, render_blood_levels(snapshot, self.banks.banks[bank_id]))
+            self.rendered[bank_id] = cached
+        return cached[1]
+
+
+def handle_unexpected_entry(chat_id):
+    """Sends the chat back to /start, the user isn't notified (by the workers and the broadcasts too) until then"""
+
+    with user_store.batch():
+        onboarding.finish(chat_id)
+        if chat_id in user:
+            user[chat_id]['bot_stage'] = 0
+            user_store.save_field([chat_id], 'bot_stage', 0)
+
+    back_to_start = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True)
+    back_to_start.add('/start')
+    dispatcher.send_message(chat_id, 'Натисни /start і вкажи свої дані знову',
+                            reply_markup=back_to_start)
+
+
+def alert_admins(error: Exception):
+    """Tells the admins (config.admin_ids) that a blood bank's page has to be looked at"""
+
+    print(f'The blood levels block has changed: \n{error}')
+    for admin_id in getattr(config, 'admin_ids', ()):
+        dispatcher.send_message(admin_id, f'\u26A0 Структура сторінки Банку Крові змінилась, '
+                                          f'сповіщення призупинено:\n{error}')
+
+
+def bank_of_chat(chat_id) -> BloodBank:
+    return banks.bank_of(user.get(chat_id, {}))
+
+
+def send_dummy_bot_error(chat_id):
+    dispatcher.send_message(chat_id, 'Дурник-бот не зрозумів :( ')
+
+
+def save_to_db(user_id):
+    user_store.save(user_id, user[user_id])
+
+
+def send_greeting_message(message):
+    cid = message.chat.id
+    blood_types_keyboard = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True)
+    blood_types_keyboard.row('I - перша', 'II - друга')
+    blood_types_keyboard.row('III - третя', 'IV - четверта')
+    onboarding.advance(cid, 0)
+    dispatcher.send_message(
+        cid, 'Привіт! Готовий рятувати життя? \nВкажи свою групу крові: ', reply_markup=blood_types_keyboard)
+    if cid in user:
+        # a returning user isn't notified until the new answers are given, the workers read the store
+        user[cid].update(blood_type=None, blood_rh=None, last_donated=None, bot_stage=0, notify_date=None)
+        save_to_db(cid)
+
+    # Displays the Telegram @username and f-l-names of the user, this info is not stored anywhere
+    print(
+        '*' * 10,
+        f'@{message.chat.username} ',
+        f'first logged in on {datetime.date.today()}',
+        '*' * 10)
+
+
+def calculate_last_donation_date(message):
+    """Defines the date of last donation as a day ordinal"""
+
+    cid = message.chat.id
+    msg = message.text
+    if msg == '2+ місяців тому':
+        return today() - 60
+    elif msg == 'Місяць тому':
+        return today() - 30
+    elif msg == "Два тижні тому":
+        return today() - 14
+    elif msg == "Тиждень тому":
+        return today() - 7
+    else:
+        return handle_unexpected_entry(cid)
+
+
+def schedule_notification(last_donation_day: int) -> int:
+    """Defines the notification date (day ordinal) based on the date of last donation"""
+
+    return last_donation_day + 60
+
+
+def bot_info(message):
+    """Shows all available commands when user types '/help' """
+    rst = '/reset - повторно вказати свою групу крові'
+    upd = '/update - перевірити запаси крові'
+    itr = '/intervals - інтервали між кроводачами'
+    inf = '/info - довідкова інформація'
+    loc = '/location - місцезнаходження Банку Крові на карті'
+    sts = '/stats - статистика дефіциту крові'
+    bnk = '/bank - обрати Банк Крові'
+    dispatcher.send_message(message.chat.id, f'{rst}\n{upd}\n{itr}\n{loc}\n{bnk}\n{sts}\n{inf}')
+
+
+def shortage_statistics(message):
+    """Shows how long each blood group has been short and how often it runs short"""
+
+    source = bank_of_chat(message.chat.id).bank_id
+    history = load_history()
+    if history is None or source not in history.source_names:
+        return dispatcher.send_message(message.chat.id, 'Статистика поки що недоступна')
+    weekdays = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Нд']
+    streaks = history.shortage_streaks(source)
+    since = history.days_since_last_shortage(source)
+    by_weekday = history.shortage_frequency(source, by='weekday')
+    lines = []
+    for number, blood_group in enumerate(BLOOD_GROUPS):
+        if since[number] < 0:
+            lines.append(f'{blood_group}: дефіциту не було')
+            continue
+        lines.append(f'{blood_group}: дефіцит {streaks["current"][number]} дн. поспіль '
+                     f'(найдовше {streaks["longest"][number]}), востаннє {since[number]} дн. тому, '
+                     f'найчастіше у {weekdays[int(by_weekday[:, number].argmax())]}')
+    dispatcher.send_message(message.chat.id, '\n'.join(lines))
+
+
+def is_admin(message) -> bool:
+    return message.chat.id in getattr(config, 'admin_ids', ())
+
+
+def show_metrics(message):
+    """Sends the current metrics to an admin (config.admin_ids)"""
+
+    # Telegram limits a message to 4096 characters, the comment lines are left out to fit more
+    lines = [line for line in metrics.render().splitlines() if not line.startswith('#')]
+    dispatcher.send_message(message.chat.id, '\n'.join(lines)[:4096])
+
+
+def start_campaign(message):
+    """/broadcast II(-) [bank] text - an admin's message to all the donors of the blood group, e.g. on an urgent
+    shortage. The progress is reported to the admin, /campaigns shows all the recent campaigns"""
+
+    words = message.text.split(maxsplit=2)
+    blood_group = blood_group_of(words[1]) if len(words) > 1 else None
+    text = words[2] if len(words) > 2 else ''
+    bank_id, *rest = text.split(maxsplit=1) or ['']
+    if bank_id in banks.banks:
+        text = rest[0] if rest else ''
+    else:
+        bank_id = None
+    if blood_group is None or not text.strip():
+        return dispatcher.send_message(message.chat.id, 'Формат: /broadcast II(-) [банк] текст повідомлення')
+    campaign_id = campaigns.create(blood_group, text, message.chat.id, bank_id)
+    report_campaign(campaigns.progress(campaign_id))
+
+
+def report_campaign(progress):
+    """Sends the campaign's progress to the admin who started it, the later reports edit the same message"""
+
+    previous = campaign_reports.get(progress.campaign_id)
+    if previous is None or (previous.done() and previous.exception() is not None):
+        campaign_reports[progress.campaign_id] = dispatcher.send_message(progress.admin_id, progress.describe())
+    elif previous.done():
+        dispatcher.submit(progress.admin_id, bot.edit_message_text, progress.describe(), progress.admin_id,
+                          previous.result().message_id)
+
+
+def show_campaigns(message):
+    recent = campaigns.recent()
+    dispatcher.send_message(message.chat.id, '\n'.join(progress.describe() for progress in recent)
+                            if recent else 'Розсилок ще не було')
+
+
+def stop_campaign(message):
+    """/campaign_stop 3 - stops the campaign after the messages already queued"""
+
+    words = message.text.split()
+    if len(words) == 2 and words[1].lstrip('#').isdigit() and campaigns.cancel(int(words[1].lstrip('#'))):
+        return dispatcher.send_message(message.chat.id, f'Розсилку {words[1]} зупинено')
+    dispatcher.send_message(message.chat.id, 'Формат: /campaign_stop номер розсилки, що триває')
+
+
+def donor_info(message):
+    """Sends a link to the Municipal Blood Centre for more information"""
+    dispatcher.send_message(message.chat.id, 'Більше інформації про процедуру та пункти здачі крові на kmck.kiev.ua')
+
+
+def donation_intervals_info(message):
+    """Sends the information about the acceptable intervals between donations"""
+    dispatcher.send_message(message.chat.id,
+                            'За даними donor.ua, оптимальним є інтервал 2-3 місяці між кровоздачами.\n\n'
+                            'Бот сповіщуватиме тебе якщо: \n'
+                            '1) з моменту останньої здачі пройшло мінімум 2 місяці'
+                            '\n2) запас крові твоєї групи у Банку низький або критичний'
+                            '\n3) якщо попередні умови задоволено - сповіщення прийде у найближчий Понеділок о 10:00\n\n'
+                            'Отримавши сповіщення, ти можеш відкласти його на тиждень (кров не здав, нагадайте ще раз)'
+                            ', або на два місяці (кров здав, до зустрічі через 2+ місяці)')
+
+
+def send_blood_bank_location(message):
+    cid = message.chat.id
+    dispatcher.submit(cid, bot.send_location, cid, *bank_of_chat(cid).location)
+
+
+def choose_blood_bank(message):
+    """Lets the user choose the blood bank whose shortages they will be notified about"""
+
+    keyboard = telebot.types.InlineKeyboardMarkup()
+    for bank in banks.banks.values():
+        keyboard.row(telebot.types.InlineKeyboardButton(text=bank.name, callback_data=f'bank:{bank.bank_id}'))
+    dispatcher.send_message(message.chat.id, 'Обери Банк Крові:', reply_markup=keyboard)
+
+
+def check_blood_availability(message):
+    """Displays the latest parsed info about blood availability"""
+
+    try:
+        reply = replies.reply_for(bank_of_chat(message.chat.id).bank_id)
+    except (StructureDriftError, NoSnapshotError):  # the page can't be read, or hasn't been downloaded yet
+        return dispatcher.send_message(message.chat.id, 'Не вдалося прочитати запаси крові на сайті Банку, '
+                                                        'спробуй трохи пізніше')
+    dispatcher.send_message(message.chat.id, reply, parse_mode='HTML')
+
+
+def share_blood_availability(query):
+    """Inline mode (@donor_notify_bot in any chat) shares the same reply as /update, the user's bank goes first"""
+
+    own_bank = bank_of_chat(query.from_user.id).bank_id
+    results = []
+    for bank_id, bank in sorted(banks.banks.items(), key=lambda item: item[0] != own_bank):
+        try:
+            reply = replies.reply_for(bank_id)
+        except (StructureDriftError, NoSnapshotError):
+            continue  # the bank's page can't be read at the moment
+        results.append(telebot.types.InlineQueryResultArticle(
+            id=bank_id, title=f'Запаси крові {bank.name}',
+            input_message_content=telebot.types.InputTextMessageContent(reply, parse_mode='HTML')))
+    dispatcher.submit(query.from_user.id, bot.answer_inline_query, query.id, results, cache_time=60)
+
+
+def callback_handler(call):
+    if call.data in ('add_one_week', 'add_two_months') and call.message.chat.id not in user:
+        return handle_unexpected_entry(call.message.chat.id)  # the chat isn't in the user table (any more)
+    if call.data == 'add_one_week':
+        notifier.reschedule_notification(str(call.message.chat.id), user, 7)
+        dispatcher.send_message(call.message.chat.id, u'\U0001F44D')
+        dispatcher.send_message(call.message.chat.id, 'Відкладаю на тиждень')
+    elif call.data == 'add_two_months':
+        notifier.reschedule_notification(str(call.message.chat.id), user, 60)
+        dispatcher.send_message(call.message.chat.id, u'\U0001F44D')
+        dispatcher.send_message(call.message.chat.id, 'Відкладаю на два місяці')
+    elif call.data.startswith('bank:') and call.data[5:] in banks.banks and call.message.chat.id in user:
+        cid = call.message.chat.id
+        user[cid]['bank'] = call.data[5:]
+        user_store.save_field([cid], 'bank', call.data[5:])
+        dispatcher.send_message(call.message.chat.id, f'Обрано: {banks.banks[call.data[5:]].name}')
+    else:
+        print('An error in call back handler has occurred')
+
+
+def delete_user_id(message):
+    """Resets the bot_stage info in the user dict and json db"""
+
+    cid = message.chat.id
+    return handle_unexpected_entry(cid)
+
+
+def welcome_message(message):
+    """Displays available blood types and asks to choose one from the list"""
+
+    cid = message.chat.id
+    # TODO: check the bot_stage of the user
+    # Implement a try/except statement, reverse the if/else conditions
+    try:
+        if user[cid]['bot_stage'] == 3:
+            dispatcher.send_message(cid, 'Схоже, ти вже в базі користувачів.\n'
+                                         'Дякую що допомагаєш рятувати життя!\n\n'
+                                         'Якщо хочеш оновити дані про себе - тисни /reset')
+        elif user[cid]['bot_stage'] != 3:
+            return send_greeting_message(message)
+    except KeyError:
+        return send_greeting_message(message)
+
+    # TODO: create a log file recording all the actions (use standard library)
+
+
+def ask_blood_rh(message):
+    """Asks for the blood RH of the user, saves the blood type into a dict"""
+    message.text = f'{message.text}'.split()[0]
+    cid = message.chat.id
+    # replacing '==' with 'in set()' expression is more concise and provides better performance
+    if message.text in {'I', 'II', 'III', 'IV'}:
+
+        blood_types_keyboard = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True)
+        blood_types_keyboard.row('(+)')
+        blood_types_keyboard.row('(-)')
+        onboarding.advance(cid, 1, blood_type=str(message.text))
+        dispatcher.send_message(cid, 'А тепер вкажи свій резус-фактор:', reply_markup=blood_types_keyboard)
+        print(f'Blood type: {message.text}')
+    else:
+        send_dummy_bot_error(cid)
+        handle_unexpected_entry(cid)
+
+
+def last_donated(message):
+    """Asks when approximately the user last donated blood. Info is used for reminders"""
+
+    cid = message.chat.id
+    if message.text in {'(+)', '(-)'}:
+        onboarding.advance(cid, 2, blood_rh=str(message.text))  # before the question, which may be answered at once
+        donation_dates_keyboard = telebot.types.ReplyKeyboardMarkup(one_time_keyboard=True)
+        donation_dates_keyboard.row("2+ місяців тому", "Місяць тому")
+        donation_dates_keyboard.row("Два тижні тому", "Тиждень тому")
+        dispatcher.send_message(cid,
+                                'Коли приблизно ти востаннє здавав кров?\n'
+                                'Від цього залежатиме коли ти отримаєш сповіщення',
+                                reply_markup=donation_dates_keyboard)
+        print(f'Blood Rh: {message.text}')
+
+    else:
+        send_dummy_bot_error(cid)
+        handle_unexpected_entry(cid)
+
+
+def thank_you_for_answers(message):
+    """Saves the answers into the user store, thanks for the information and shows a list of available commands.
+    The user is saved before the reply, so the next update of the chat finds the user in place"""
+
+    cid = message.chat.id
+    possible_dates = {"2+ місяців тому", "Місяць тому", "Два тижні тому", "Тиждень тому"}
+    if message.text in possible_dates:
+        print(f'Last donated: {message.text}\n', '*' * 80)
+
+        session = onboarding.get(cid)
+        last_donation_date = calculate_last_donation_date(message)
+        user[cid] = dict(blood_type=session.blood_type,
+                         blood_rh=session.blood_rh,
+                         last_donated=last_donation_date,
+                         bot_stage=3,
+                         notify_date=schedule_notification(last_donation_date),
+                         bank=user.get(cid, {}).get('bank') or DEFAULT_BANK)
+        save_to_db(cid)
+        onboarding.finish(cid)
+
+        emoji = u'\U0001F618'
+        quest = 'Переглянути повний список функцій - тисни /help'
+        keyboard_remove = telebot.types.ReplyKeyboardRemove(selective=True)
+        dispatcher.send_message(cid, 'All done!\nТепер я надсилатиму тобі сповіщення, '
+                                     f'якщо виникне необхідність у крові твоєї групи! {emoji}\n\n{quest}',
+                                reply_markup=keyboard_remove)
+        if user[cid].notify_day <= today() and notifies_here():
+            scheduler.call_soon(notifier.decide_when_to_notify)  # it may be the notification hour right now
+    else:
+        send_dummy_bot_error(cid)
+        handle_unexpected_entry(cid)
+
+
+def is_onboarding(message) -> bool:
+    """Text answers of the chats in the middle of the /start dialog, the commands are handled as usual"""
+
+    return message.text is not None and not message.text.startswith('/') \
+        and onboarding.get(message.chat.id) is not None
+
+
+def continue_onboarding(message):
+    """Routes the answer to the step the chat's onboarding is at"""
+
+    steps = {0: ask_blood_rh, 1: last_donated, 2: thank_you_for_answers}
+    return steps[onboarding.get(message.chat.id).stage](message)
+
+
+def register_handlers(telegram_bot: telebot.TeleBot):
+    """Registers the handlers in the order they are matched"""
+
+    telegram_bot.message_handler(commands=['help'])(bot_info)
+    telegram_bot.message_handler(commands=['stats'])(shortage_statistics)
+    telegram_bot.message_handler(commands=['metrics'], func=is_admin)(show_metrics)
+    telegram_bot.message_handler(commands=['broadcast'], func=is_admin)(start_campaign)
+    telegram_bot.message_handler(commands=['campaigns'], func=is_admin)(show_campaigns)
+    telegram_bot.message_handler(commands=['campaign_stop'], func=is_admin)(stop_campaign)
+    telegram_bot.message_handler(commands=['info'])(donor_info)
+    telegram_bot.message_handler(commands=['intervals'])(donation_intervals_info)
+    telegram_bot.message_handler(commands=['location'])(send_blood_bank_location)
+    telegram_bot.message_handler(commands=['bank'])(choose_blood_bank)
+    telegram_bot.message_handler(commands=['update'])(check_blood_availability)
+    telegram_bot.inline_handler(func=lambda query: True)(share_blood_availability)
+    telegram_bot.callback_query_handler(func=lambda call: True)(callback_handler)
+    telegram_bot.message_handler(commands=['reset'])(delete_user_id)
+    telegram_bot.message_handler(commands=['start'])(welcome_message)
+    telegram_bot.message_handler(func=is_onboarding)(continue_onboarding)
+
+
+def run_webhook(public_url: str, port: int):
+    """Receives the updates through the webhook until SIGINT/SIGTERM, then drains the queued updates.
+    TLS is expected to be terminated by a reverse proxy forwarding public_url to the port"""
+
+    bot.threaded = False  # the handlers run inside the pool's workers, which keep the order of the chat's updates
+    pool = UpdatePool(bot)
+    pool.start()
+    metrics.gauge('donor_bot_update_queue_depth', 'Updates waiting for the handlers', pool.queue_depth)
+    server = WebhookServer(pool, '0.0.0.0', port, f'/{config.token}')
+    server.start()
+    bot.remove_webhook()
+    bot.set_webhook(url=f'{public_url.rstrip("/")}/{config.token}')
+
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+    dispatcher.stop()
+
+
+def run_polling(interval: float = 1.5, timeout: int = 20):
+    """Long polling until bot.stop_polling(). A connection error on Telegram's side or an error in a handler
+    stops telebot's polling, which is started again after a pause"""
+
+    while 1:
+        try:
+            return bot.polling(none_stop=True, interval=interval, timeout=timeout)
+        except Exception as e:
+            print(f'Error in the polling process: \n{e}')
+            time.sleep(5)
+
+
+def refresh_blood_levels():
+    """Refreshes the pages of all the banks, the users of the blood groups that have just run short
+    are evaluated right away instead of waiting for the next run"""
+
+    previous = {bank_id: cache.snapshot for bank_id, cache in banks.caches.items()}
+    became_low = set()
+    snapshots = banks.refresh_all()
+    for bank_id, snapshot in snapshots.items():
+        if snapshot is not None and previous[bank_id] is not None:
+            became_low.update((bank_id, blood_group) for blood_group in snapshot.new_shortages(previous[bank_id]))
+    try:
+        if notifier.shards is None:  # the worker processes don't answer /stats
+            record_history(snapshots)
+    except Exception as e:
+        print(f'Error while saving the blood levels history: \n{e}')
+    if became_low and notifies_here():
+        scheduler.call_soon(lambda: notifier.decide_when_to_notify(became_low))  # the notifier's runs don't overlap
+
+
+def notifies_here() -> bool:
+    """config.notify_shards = N leaves the notifications to the worker processes (donor_bot.worker),
+    which split the users into N shards"""
+
+    return notifier.shards is not None or not getattr(config, 'notify_shards', 0)
+
+
+def background_processing():
+    refresh_scheduler.call_every(banks.ttl(), refresh_blood_levels)
+    refresh_scheduler.start()
+    scheduler.call_every(3600, onboarding.evict_expired)
+    if notifies_here():
+        notifier.schedule_runs(scheduler)
+    return scheduler.start()
+
+
+def start_metrics_server():
+    """Serves /metrics on config.metrics_port (9108 by default),
+    config.profile_notifier = True also samples the scheduler's thread, where the notifier runs, into /profile"""
+
+    server = MetricsServer(metrics, getattr(config, 'metrics_port', 9108))
+    if getattr(config, 'profile_notifier', False):
+        server.profiler = SamplingProfiler(scheduler.thread)
+        server.profiler.start()
+    return server.start()
+
+
+def main():
+    """Entry point of the bot (python -m donor_bot)"""
+
+    init()
+    dispatcher.start()
+    campaigns.resume()
+    background_processing()
+    start_metrics_server()
+
+    # config.webhook_url switches the bot from long polling to the webhook mode
+    if getattr(config, 'webhook_url', None):
+        run_webhook(config.webhook_url, getattr(config, 'webhook_port', 8443))
+    else:
+        run_polling()
@@ -0,0 +1,228 @@
+"""Broadcast campaigns: an admin's message to all the donors of a blood group (optionally of one bank),
+e.g. on an urgent shortage. The recipients are read from the user store page by page instead of being loaded
+at once, and the progress is checkpointed there, so a campaign interrupted by a restart continues where it stopped"""
+
+import threading
+import time
+from collections import deque
+from typing import NamedTuple
+
+from donor_bot.levels import DEFAULT_BANK
+from donor_bot.metrics import metrics
+from donor_bot.store import UserStore
+
+
+class CampaignProgress(NamedTuple):
+    campaign_id: int
+    blood_group: str
+    bank_id: str  # None if the campaign addresses the donors of all the banks
+    admin_id: int
+    status: str  # running, done or cancelled
+    total: int  # recipients counted when the campaign was created
+    sent: int
+    failed: int
+    lost: int  # handed to the Bot API before the process stopped, not repeated and not known to be delivered
+    rate: float  # messages per second since the campaign was (re)started
+    eta: float  # seconds left, None until the rate is known
+
+    def describe(self) -> str:
+        target = self.blood_group if self.bank_id is None else f'{self.blood_group} ({self.bank_id})'
+        line = f'Розсилка #{self.campaign_id} {target}: {self.sent} з {self.total} надіслано'
+        if self.failed:
+            line += f', {self.failed} не доставлено'
+        if self.lost:
+            line += f', {self.lost} перервано перезапуском'
+        if self.status != 'running':
+            return f'{line}, {"завершено" if self.status == "done" else "зупинено"}'
+        if self.eta is None:
+            return line
+        return f'{line}, {self.rate:.0f} повідомлень/с, залишилось ~{self.eta / 60:.0f} хв'
+
+
+class Campaigns:
+    """Runs the broadcast campaigns, one thread per campaign. The recipients are taken in the chat id order,
+    the cursor of the batches that are done is checkpointed. A send-once marker of the recipient is stored right
+    before its message is handed to the Bot API, so a crash never sends a message twice: resume() goes back to
+    the checkpoint and skips the marked recipients, the marked ones of the batches in flight are counted as lost.
+    A single process should run them"""
+
+    batch_size = 50  # recipients read and checkpointed at once
+    # batches queued in the dispatcher: the oldest one is waited for while the others keep all its workers busy
+    in_flight = 8
+    report_every = 60  # seconds between the progress reports given to the listeners
+
+    def __init__(self, store: UserStore, dispatcher):
+        self.store = store
+        self.dispatcher = dispatcher  # MessageDispatcher
+        self.listeners = []  # called with the CampaignProgress of the running campaigns
+        self.rates = dict()  # campaign id -> (time.monotonic() of the start, messages handled since then)
+        self.threads = dict()  # campaign id -> the thread sending it
+        self.cancelled = set()
+        with store.batch():
+            store.connection.execute('CREATE TABLE IF NOT EXISTS campaigns ('
+                                     'campaign_id INTEGER PRIMARY KEY, blood_type TEXT, blood_rh TEXT, bank TEXT, '
+                                     'text TEXT, admin_id INTEGER, status TEXT, total INTEGER, '
+                                     'claimed TEXT, done TEXT, sent INTEGER, failed INTEGER, lost INTEGER, '
+                                     'created_at REAL, updated_at REAL)')
+            store.connection.execute('CREATE TABLE IF NOT EXISTS campaign_sent ('
+                                     'campaign_id INTEGER, chat_id TEXT, PRIMARY KEY (campaign_id, chat_id))')
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    @staticmethod
+    def where(blood_type: str, blood_rh: str, bank_id: str) -> tuple:
+        """The condition selecting the recipients and its parameters, the users without a bank are the default one's"""
+
+        condition = 'blood_type = ? AND blood_rh = ? AND bot_stage = 3'
+        if bank_id is None:
+            return condition, (blood_type, blood_rh)
+        return f'{condition} AND coalesce(bank, ?) = ?', (blood_type, blood_rh, DEFAULT_BANK, bank_id)
+
+    def create(self, blood_group: str, text: str, admin_id: int, bank_id: str = None) -> int:
+        """Stores a new campaign and starts sending it, returns its id"""
+
+        blood_type, blood_rh = blood_group[:-3], blood_group[-3:]
+        condition, parameters = self.where(blood_type, blood_rh, bank_id)
+        now = time.time()
+        with self.store.batch():
+            total = self.store.connection.execute(f'SELECT count(*) FROM users WHERE {condition}',
+                                                  parameters).fetchone()[0]
+            campaign_id = self.store.connection.execute(
+                "INSERT INTO campaigns VALUES (NULL, ?, ?, ?, ?, ?, 'running', ?, '', '', 0, 0, 0, ?, ?)",
+                (blood_type, blood_rh, bank_id, text, admin_id, total, now, now)).lastrowid
+        print(f'Campaign {campaign_id}: {blood_group} of {bank_id or "all the banks"}, {total} recipients')
+        self.start(campaign_id)
+        return campaign_id
+
+    def resume(self) -> list:
+        """Restarts the campaigns interrupted by the previous process from the last batch that was done.
+        The recipients of the batches in flight that have a send-once marker are counted as lost,
+        the others are sent again. Returns the ids of the resumed campaigns"""
+
+        with self.store.batch():
+            rows = self.store.connection.execute("SELECT campaign_id, blood_type, blood_rh, bank, claimed, done "
+                                                 "FROM campaigns WHERE status = 'running'").fetchall()
+            for campaign_id, blood_type, blood_rh, bank_id, claimed, done in rows:
+                lost = self.store.connection.execute(
+                    'SELECT count(*) FROM campaign_sent WHERE campaign_id = ? AND chat_id > ? AND chat_id <= ?',
+                    (campaign_id, done, claimed)).fetchone()[0]
+                self.store.connection.execute('UPDATE campaigns SET claimed = done, lost = lost + ? '
+                                              'WHERE campaign_id = ?', (lost, campaign_id))
+        for campaign_id, *_ in rows:
+            print(f'Campaign {campaign_id} is resumed')
+            self.start(campaign_id)
+        return [campaign_id for campaign_id, *_ in rows]
+
+    def start(self, campaign_id: int):
+        thread = threading.Thread(target=self.run, args=(campaign_id,), daemon=True)
+        self.threads[campaign_id] = thread
+        thread.start()
+
+    def cancel(self, campaign_id: int) -> bool:
+        """Stops the campaign after the batches already queued, returns False if it isn't running"""
+
+        if campaign_id not in self.threads or not self.threads[campaign_id].is_alive():
+            return False
+        self.cancelled.add(campaign_id)
+        return True
+
+    def wait(self, campaign_id: int, timeout: float = None):
+        self.threads[campaign_id].join(timeout)
+
+    def recipients(self, campaign, after: str) -> list:
+        """The next batch of the chat ids after the cursor without a send-once marker,
+        found through the primary key indexes"""
+
+        condition, parameters = self.where(campaign['blood_type'], campaign['blood_rh'], campaign['bank'])
+        with self.store.lock:
+            return [chat_id for chat_id, in self.store.connection.execute(
+                f'SELECT chat_id FROM users WHERE chat_id > ? AND {condition} AND NOT EXISTS ('
+                'SELECT 1 FROM campaign_sent WHERE campaign_id = ? AND campaign_sent.chat_id = users.chat_id) '
+                'ORDER BY chat_id LIMIT ?', (after, *parameters, campaign['campaign_id'], self.batch_size))]
+
+    def send_once(self, campaign_id: int, chat_id: str, text: str):
+        """Called by the dispatcher's worker: stores the recipient's marker, then sends the message"""
+
+        with self.store.batch():
+            self.store.connection.execute('INSERT OR IGNORE INTO campaign_sent VALUES (?, ?)', (campaign_id, chat_id))
+        return self.dispatcher.bot.send_message(int(chat_id), text)
+
+    def load(self, campaign_id: int) -> dict:
+        with self.store.lock:
+            cursor = self.store.connection.execute('SELECT * FROM campaigns WHERE campaign_id = ?', (campaign_id,))
+            row = cursor.fetchone()
+        if row is None:
+            raise KeyError(campaign_id)
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def progress(self, campaign_id: int) -> CampaignProgress:
+        campaign = self.load(campaign_id)
+        handled = campaign['sent'] + campaign['failed'] + campaign['lost']
+        rate, eta = 0.0, None
+        if campaign_id in self.rates:
+            started, handled_since = self.rates[campaign_id]
+            rate = handled_since / max(time.monotonic() - started, 1e-3)
+            if rate > 0:
+                eta = max(0, campaign['total'] - handled) / rate
+        return CampaignProgress(campaign_id, f'{campaign["blood_type"]}{campaign["blood_rh"]}', campaign['bank'],
+                                campaign['admin_id'], campaign['status'], campaign['total'], campaign['sent'],
+                                campaign['failed'], campaign['lost'], rate, eta)
+
+    def recent(self, count: int = 5) -> list:
+        with self.store.lock:
+            ids = [campaign_id for campaign_id, in self.store.connection.execute(
+                'SELECT campaign_id FROM campaigns ORDER BY campaign_id DESC LIMIT ?', (count,))]
+        return [self.progress(campaign_id) for campaign_id in ids]
+
+    def report(self, campaign_id: int):
+        progress = self.progress(campaign_id)
+        for callback in self.listeners:
+            try:
+                callback(progress)
+            except Exception as e:
+                print(f'Error in a campaign listener: \n{e}')
+
+    def run(self, campaign_id: int):
+        """Sends the campaign batch by batch, keeping in_flight batches queued in the dispatcher"""
+
+        campaign = self.load(campaign_id)
+        started = reported = time.monotonic()
+        self.rates[campaign_id] = (started, 0)
+        pending = deque()  # (cursor after the batch, futures of its messages)
+        cursor, exhausted = campaign['claimed'], False
+        while pending or not exhausted:
+            if not exhausted and len(pending) < self.in_flight:
+                batch = [] if campaign_id in self.cancelled else self.recipients(campaign, cursor)
+                if not batch:
+                    exhausted = True
+                    continue
+                cursor = batch[-1]
+                # the recipients up to the claimed cursor may have been sent, resume() checks their markers
+                with self.store.batch():
+                    self.store.connection.execute('UPDATE campaigns SET claimed = ?, updated_at = ? '
+                                                  'WHERE campaign_id = ?', (cursor, time.time(), campaign_id))
+                pending.append((cursor, [self.dispatcher.submit(int(chat_id), self.send_once, campaign_id, chat_id,
+                                                                campaign['text'], bulk=True)
+                                         for chat_id in batch]))
+                continue
+            done, deliveries = pending.popleft()
+            failed = sum(delivery.exception() is not None for delivery in deliveries)  # waits for the batch
+            metrics.campaign_messages.inc(len(deliveries) - failed)
+            with self.store.batch():
+                self.store.connection.execute('UPDATE campaigns SET done = ?, sent = sent + ?, failed = failed + ?, '
+                                              'updated_at = ? WHERE campaign_id = ?',
+                                              (done, len(deliveries) - failed, failed, time.time(), campaign_id))
+            self.rates[campaign_id] = (started, self.rates[campaign_id][1] + len(deliveries))
+            if time.monotonic() - reported >= self.report_every:
+                reported = time.monotonic()
+                self.report(campaign_id)
+
+        status = 'cancelled' if campaign_id in self.cancelled else 'done'
+        with self.store.batch():
+            self.store.connection.execute('UPDATE campaigns SET status = ?, updated_at = ? WHERE campaign_id = ?',
+                                          (status, time.time(), campaign_id))
+            self.store.connection.execute('DELETE FROM campaign_sent WHERE campaign_id = ?', (campaign_id,))
+        self.cancelled.discard(campaign_id)
+        print(self.progress(campaign_id).describe())
+        self.report(campaign_id)
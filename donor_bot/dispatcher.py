@@ -0,0 +1,182 @@
+"""Outgoing messages: a pool of workers staying under Telegram's rate limits"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import requests
+import telebot
+
+from donor_bot.metrics import metrics
+
+
+class TokenBucket:
+    """Lets through `rate` events per second on average, with bursts of up to `capacity` events"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Takes a token and returns how many seconds the caller has to wait before using it"""
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def pause(self, seconds: float):
+        """Empties the bucket for at least the given time, used when Telegram answers with 429.
+        The 429s of the calls made at the same time don't add up"""
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_full(self) -> bool:
+        return self.tokens + (time.monotonic() - self.updated) * self.rate >= self.capacity
+
+
+class WorkerQueue:
+    """Jobs of one worker in two lanes: the replies to the users are taken before the bulk messages (notifications,
+    broadcasts). Only the bulk lane is bounded, a long run of notifications never blocks a handler's reply"""
+
+    def __init__(self, bulk_size: int):
+        self.replies = deque()
+        self.bulk = deque()
+        self.bulk_size = bulk_size
+        self.condition = threading.Condition()
+
+    def put(self, job, bulk: bool = False):
+        """Queues the job, blocks while the bulk lane is full"""
+
+        with self.condition:
+            if bulk:
+                while len(self.bulk) >= self.bulk_size:
+                    self.condition.wait()
+                self.bulk.append(job)
+            else:
+                self.replies.append(job)
+            self.condition.notify_all()
+
+    def get(self):
+        with self.condition:
+            while not self.replies and not self.bulk:
+                self.condition.wait()
+            job = self.replies.popleft() if self.replies else self.bulk.popleft()
+            self.condition.notify_all()
+            return job
+
+    def qsize(self) -> int:
+        return len(self.replies) + len(self.bulk)
+
+
+class MessageDispatcher:
+    """Sends the outgoing messages from a pool of workers, staying under Telegram's rate limits.
+    Messages of the same chat are handled by the same worker, so they arrive in the order they were sent
+    (a reply may overtake a bulk message queued earlier)"""
+
+    def __init__(self, bot: telebot.TeleBot, workers: int = 8, queue_size: int = 1000, global_rate: float = 25,
+                 chat_rate: float = 1, chat_burst: float = 3, max_retries: int = 4):
+        self.bot = bot
+        self.queues = [WorkerQueue(queue_size) for _ in range(workers)]
+        # Telegram's limit is 30 messages/s counted by the arrivals, the jitter of the network needs a margin under it.
+        # No bursts, the global limit is checked per second
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self.chat_buckets = dict()
+        self.max_chat_buckets = 10000  # the idle buckets are forgotten once there are more
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def submit(self, chat_id, method, *args, bulk: bool = False, **kwargs) -> Future:
+        """Queues a bot API call addressed to the chat. The bulk calls (notifications, broadcasts) wait for the
+        replies to the users and block while the worker's bulk lane is full"""
+
+        future = Future()
+        self.queues[hash(str(chat_id)) % len(self.queues)].put((future, chat_id, method, args, kwargs), bulk)
+        return future
+
+    def send_message(self, chat_id, text, bulk: bool = False, **kwargs) -> Future:
+        return self.submit(chat_id, self.bot.send_message, chat_id, text, bulk=bulk, **kwargs)
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def chat_bucket(self, chat_id) -> TokenBucket:
+        with self.lock:
+            if len(self.chat_buckets) > self.max_chat_buckets:  # forgets the chats not written to recently
+                self.chat_buckets = {key: value for key, value in self.chat_buckets.items() if not value.is_full()}
+                # a broadcast writes to more chats than that within a second, the next cleanup waits for twice as many
+                self.max_chat_buckets = max(10000, 2 * len(self.chat_buckets))
+            if chat_id not in self.chat_buckets:
+                self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            return self.chat_buckets[chat_id]
+
+    def call(self, chat_id, method, args, kwargs):
+        """Makes the call, waits for the rate limits, honours 429 retry_after and retries the transient errors"""
+
+        chat_bucket = self.chat_bucket(chat_id)
+        for attempt in range(self.max_retries + 1):
+            time.sleep(max(chat_bucket.reserve(), self.global_bucket.reserve()))
+            try:
+                with metrics.telegram_send.time():
+                    return method(*args, **kwargs)
+            except telebot.apihelper.ApiException as e:
+                response = getattr(e, 'result', None)
+                status = getattr(response, 'status_code', None)
+                if status == 429 and attempt < self.max_retries:
+                    try:
+                        retry_after = response.json()['parameters']['retry_after']
+                    except (ValueError, KeyError, TypeError):
+                        retry_after = 1
+                    # the 429 may come from the global limit as well as from the chat's one, both wait
+                    chat_bucket.pause(retry_after)
+                    self.global_bucket.pause(retry_after)
+                elif status is not None and status >= 500 and attempt < self.max_retries:
+                    time.sleep(0.5 * 2 ** attempt)
+                else:
+                    raise
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+
+    def work(self, jobs: WorkerQueue):
+        while 1:
+            job = jobs.get()
+            if job is None:
+                break
+            future, chat_id, method, args, kwargs = job
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self.call(chat_id, method, args, kwargs))
+                except Exception as e:
+                    print(f'Failed to send a message to {chat_id}: \n{e}')
+                    metrics.messages_failed.inc()
+                    future.set_exception(e)
+
+    def start(self):
+        for jobs in self.queues:
+            thread = threading.Thread(target=self.work, args=(jobs,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Sends the messages that are already queued and stops the workers"""
+
+        for jobs in self.queues:
+            jobs.put(None, bulk=True)  # after the bulk messages already queued
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
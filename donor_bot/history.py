@@ -0,0 +1,272 @@
+"""History of the blood levels in MySQL (or any SQLAlchemy database) and its columnar copy for the statistics"""
+
+import datetime
+import json
+import os
+import shutil
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from sqlalchemy import create_engine, inspect, text, Column, Integer, String, Date, UniqueConstraint
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from donor_bot.levels import BLOOD_GROUPS, LEVEL_ENOUGH, BloodLevels, encode_level
+from donor_bot.metrics import metrics
+
+
+class MysqlDatabase:
+    """Class containing all the functions related to db's CRUD"""
+
+    Base = declarative_base()
+
+    def __init__(self, db_credentials: str):
+        self.mysql_credentials = db_credentials
+        # one pooled engine per process, pre_ping replaces the connections dropped by the server's wait_timeout
+        self.engine = create_engine(self.mysql_credentials, pool_pre_ping=True, pool_recycle=3600)
+        self.Session = sessionmaker(bind=self.engine)
+        # for convenience pymysql is used instead of the official mysql.connector
+        # (the latter is maintained by MySQL team)
+
+    class BloodLevelsTable(Base):
+        """Creates the blood_by_group table and defines its structure"""
+
+        # tablename is a compulsory attribute for the Base constructor to work
+        __tablename__ = 'blood_availability'
+        # a single row per day and blood bank, saving the same day again overwrites it
+        __table_args__ = (UniqueConstraint('date', 'source', name='uq_blood_availability_date_source'),)
+        # Data types should be imported from the sqlalchemy library before using them
+        id = Column(Integer, primary_key=True)
+        date = Column(Date)
+        source = Column(String(50), nullable=False, default='kmck')  # the blood bank the levels were parsed from
+        one_plus = Column('I (+)', String(50), nullable=False)
+        two_plus = Column('II (+)', String(50), nullable=False)
+        tree_plus = Column('III (+)', String(50), nullable=False)
+        four_plus = Column('IV (+)', String(50), nullable=False)
+        one_minus = Column('I (–)', String(50), nullable=False)
+        two_minus = Column('II (–)', String(50), nullable=False)
+        tree_minus = Column('III (–)', String(50), nullable=False)
+        four_minus = Column('IV (–)', String(50), nullable=False)
+
+    # attributes of BloodLevelsTable in the order of BLOOD_GROUPS
+    level_columns = ('one_plus', 'two_plus', 'tree_plus', 'four_plus',
+                     'one_minus', 'two_minus', 'tree_minus', 'four_minus')
+
+    def create_table(self):
+        # 'create_all' method creates the structure outlined in BloodLevelsTable
+        self.Base.metadata.create_all(self.engine)
+        self.migrate()
+
+    def migrate(self):
+        """Brings a table created before the blood banks were added up to date, create_all() never alters one:
+        adds the source column (the rows so far are the Kyiv bank's) and makes the day of a source unique,
+        the rows saved by every refresh of a day are reduced to the latest one"""
+
+        table = self.BloodLevelsTable.__tablename__
+        inspector = inspect(self.engine)
+        columns = [column['name'] for column in inspector.get_columns(table)]
+        unique = [constraint['column_names'] for constraint in inspector.get_unique_constraints(table)] \
+            + [index['column_names'] for index in inspector.get_indexes(table) if index['unique']]
+        with self.engine.begin() as connection:
+            if 'source' not in columns:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN source VARCHAR(50) NOT NULL DEFAULT 'kmck'"))
+                print(f'The source column is added to {table}')
+            if ['date', 'source'] not in unique:
+                # the derived table lets MySQL read the table it deletes from
+                removed = connection.execute(text(
+                    f'DELETE FROM {table} WHERE id NOT IN (SELECT latest FROM '
+                    f'(SELECT max(id) AS latest FROM {table} GROUP BY date, source) AS latest_rows)')).rowcount
+                connection.execute(text(f'CREATE UNIQUE INDEX uq_{table}_date_source ON {table} (date, source)'))
+                print(f'{removed} earlier rows of the same days are removed from {table}')
+
+    def row_of(self, snapshot: BloodLevels, source: str = 'kmck') -> dict:
+        return dict(date=snapshot.date, source=source, **dict(zip(self.level_columns, snapshot.levels)))
+
+    def upsert_rows(self, rows: list):
+        """Replaces the rows of the same dates and sources in a single transaction,
+        delete + bulk insert behaves the same on MySQL and on SQLite"""
+
+        table = self.BloodLevelsTable
+        session = self.Session()
+        started = time.perf_counter()
+        try:
+            dates_by_source = defaultdict(list)
+            for row in rows:
+                dates_by_source[row['source']].append(row['date'])
+            for source, dates in dates_by_source.items():
+                session.query(table).filter(table.source == source, table.date.in_(dates)) \
+                    .delete(synchronize_session=False)
+            session.bulk_insert_mappings(table, rows)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+            metrics.db_write.observe(time.perf_counter() - started)
+
+    def save_bloodlvl_to_mysql(self, registry):
+        """Saves the clean information into the MysqlDB"""
+        self.upsert_rows([self.row_of(registry.snapshot(bank_id), bank_id) for bank_id in registry.caches])
+
+
+class HistoryWriter:
+    """Buffers the blood levels snapshots and writes them into the history table in bulk,
+    there is one row per date and source, the latest snapshot of a day wins"""
+
+    def __init__(self, database: MysqlDatabase, batch_size: int = 500):
+        self.database = database
+        self.batch_size = batch_size
+        self.buffer = dict()  # (date, source) -> row
+        self.lock = threading.Lock()
+
+    def add(self, snapshot: BloodLevels, source: str = None):
+        source = source or snapshot.source
+        with self.lock:
+            self.buffer[(snapshot.date, source)] = self.database.row_of(snapshot, source)
+            is_full = len(self.buffer) >= self.batch_size
+        if is_full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Writes the buffered rows in batches of batch_size, returns the number of rows written"""
+
+        with self.lock:
+            rows = list(self.buffer.values())
+            self.buffer.clear()
+        for start in range(0, len(rows), self.batch_size):
+            self.database.upsert_rows(rows[start:start + self.batch_size])
+        return len(rows)
+
+    def write(self, snapshot: BloodLevels):
+        """Listener for SnapshotCache, writes every newly parsed snapshot right away"""
+
+        self.add(snapshot)
+        self.flush()
+
+
+class DataFrame:
+    """Columnar copy of the blood_availability history, the queries are vectorized over the numpy arrays:
+    days - days since 1970-01-01, sources - index into source_names, levels - one LEVEL_* per blood group"""
+
+    def __init__(self, days, sources, levels, source_names: list):
+        self.days = days
+        self.sources = sources
+        self.levels = levels
+        self.source_names = source_names
+
+    @classmethod
+    def convert_into_data_frame(cls, database: MysqlDatabase) -> 'DataFrame':
+        """Reads the whole history table into the arrays, sorted by source and date"""
+
+        table = database.BloodLevelsTable
+        session = database.Session()
+        try:
+            rows = session.query(table.source, table.date, *[getattr(table, column) for column in
+                                                              database.level_columns]) \
+                .order_by(table.source, table.date).all()
+        finally:
+            session.close()
+        source_names = sorted({row[0] for row in rows})
+        source_ids = {name: number for number, name in enumerate(source_names)}
+        epoch = datetime.date(1970, 1, 1).toordinal()
+        days = np.fromiter((row[1].toordinal() - epoch for row in rows), dtype=np.int32, count=len(rows))
+        sources = np.fromiter((source_ids[row[0]] for row in rows), dtype=np.int16, count=len(rows))
+        levels = np.array([[encode_level(level) for level in row[2:]] for row in rows], dtype=np.uint8)
+        return cls(days, sources, levels.reshape(len(rows), len(BLOOD_GROUPS)), source_names)
+
+    @classmethod
+    def empty(cls) -> 'DataFrame':
+        return cls(np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int16),
+                   np.zeros((0, len(BLOOD_GROUPS)), dtype=np.uint8), [])
+
+    def with_snapshot(self, snapshot: BloodLevels, source: str = None) -> 'DataFrame':
+        """A copy holding the snapshot's row, the latest snapshot of a day replaces the earlier one.
+        Returns self if the history already has the same levels on that day"""
+
+        source = source or snapshot.source
+        day = (snapshot.date - datetime.date(1970, 1, 1)).days
+        levels = np.array([encode_level(level) for level in snapshot.levels], dtype=np.uint8)
+        source_names = sorted(set(self.source_names) | {source})
+        # a new source shifts the ids of the sources sorted after it
+        source_ids = np.array([source_names.index(name) for name in self.source_names], dtype=np.int16)
+        sources = source_ids[self.sources] if len(self.sources) else np.zeros(0, dtype=np.int16)
+        keys = sources.astype(np.int64) << 32 | self.days  # the rows are sorted by source and date
+        key = source_names.index(source) << 32 | day
+        row = int(np.searchsorted(keys, key))
+        if row < len(keys) and keys[row] == key:
+            if (self.levels[row] == levels).all():
+                return self
+            replaced = np.array(self.levels)
+            replaced[row] = levels
+            return DataFrame(np.array(self.days), sources, replaced, source_names)
+        return DataFrame(np.insert(self.days, row, day), np.insert(sources, row, source_names.index(source)),
+                         np.insert(self.levels, row, levels, axis=0), source_names)
+
+    def save(self, directory: str):
+        """Writes the arrays into a new directory and puts it in place of the previous one,
+        the arrays already memory-mapped by load() stay readable"""
+
+        temporary = f'{directory}.{os.getpid()}.tmp'
+        os.makedirs(temporary, exist_ok=True)
+        for name in ('days', 'sources', 'levels'):
+            np.save(os.path.join(temporary, f'{name}.npy'), getattr(self, name))
+        with open(os.path.join(temporary, 'sources.json'), 'w') as json_file:
+            json.dump(self.source_names, json_file)
+        if not os.path.isdir(directory):
+            return os.replace(temporary, directory)
+        previous = f'{directory}.{os.getpid()}.old'
+        os.replace(directory, previous)
+        os.replace(temporary, directory)
+        shutil.rmtree(previous)
+
+    @classmethod
+    def load(cls, directory: str) -> 'DataFrame':
+        """Memory-maps the arrays saved by save(), only the pages touched by the queries are read from disk"""
+
+        arrays = [np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+                  for name in ('days', 'sources', 'levels')]
+        with open(os.path.join(directory, 'sources.json')) as json_file:
+            return cls(*arrays, json.load(json_file))
+
+    def shortages(self, source: str = 'kmck'):
+        """Returns the days and a (days x blood groups) boolean matrix of shortages of one blood bank"""
+
+        rows = self.sources == self.source_names.index(source)
+        return self.days[rows], self.levels[rows] != LEVEL_ENOUGH
+
+    def shortage_streaks(self, source: str = 'kmck') -> dict:
+        """Current and longest run of consecutive records with a shortage, per blood group"""
+
+        _, short = self.shortages(source)
+        edges = np.diff(np.pad(short.astype(np.int8), ((1, 1), (0, 0))), axis=0)
+        start_groups, start_rows = np.nonzero(edges.T == 1)  # runs are paired by group, in the order of rows
+        _, end_rows = np.nonzero(edges.T == -1)
+        longest = np.zeros(len(BLOOD_GROUPS), dtype=np.int64)
+        np.maximum.at(longest, start_groups, end_rows - start_rows)
+        reversed_short = short[::-1]
+        current = np.where(reversed_short.all(axis=0), len(short), reversed_short.argmin(axis=0))
+        return {'current': current, 'longest': longest}
+
+    def shortage_frequency(self, source: str = 'kmck', by: str = 'weekday'):
+        """Share of the records with a shortage per weekday (Mon=0) or per month (Jan=0), shape (7 or 12, groups)"""
+
+        days, short = self.shortages(source)
+        if by == 'weekday':
+            buckets, size = (days + 3) % 7, 7  # 1970-01-01 was a Thursday
+        else:
+            buckets, size = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) % 12, 12
+        counts = np.zeros((size, len(BLOOD_GROUPS)), dtype=np.int64)
+        np.add.at(counts, buckets, short)
+        totals = np.bincount(buckets, minlength=size)[:, None]
+        return np.divide(counts, totals, out=np.zeros(counts.shape), where=totals > 0)
+
+    def days_since_last_shortage(self, source: str = 'kmck', today: datetime.date = None):
+        """Days since the latest shortage per blood group, -1 if there has never been one"""
+
+        days, short = self.shortages(source)
+        today = ((today or datetime.date.today()) - datetime.date(1970, 1, 1)).days
+        last_row = len(short) - 1 - short[::-1].argmax(axis=0)
+        return np.where(short.any(axis=0), today - days[last_row], -1)
@@ -0,0 +1,38 @@
+"""Blood groups and the snapshot of their levels, shared by the parser, the notifier and the history"""
+
+import datetime
+from typing import NamedTuple
+
+DEFAULT_BANK = 'kmck'  # the bank of the users who haven't chosen one
+BLOOD_GROUPS = ('I(+)', 'II(+)', 'III(+)', 'IV(+)', 'I(-)', 'II(-)', 'III(-)', 'IV(-)')
+ENOUGH = 'Достатньо'  # the level published by the blood bank when there is no shortage
+LEVELS = (ENOUGH, 'Мало', 'Дуже мало', 'Критично', 'Критично мало')  # all the levels the blood bank publishes
+LEVEL_ENOUGH, LEVEL_LOW, LEVEL_CRITICAL = 0, 1, 2  # compact encoding of the levels used by the history
+
+
+def encode_level(level: str) -> int:
+    if level == ENOUGH:
+        return LEVEL_ENOUGH
+    if 'критич' in level.lower():
+        return LEVEL_CRITICAL
+    return LEVEL_LOW
+
+
+class BloodLevels(NamedTuple):
+    """Immutable snapshot of the blood levels published on the page at a certain moment"""
+
+    date: datetime.date
+    levels: tuple  # one level per blood group, in the order of BLOOD_GROUPS
+    source: str = DEFAULT_BANK  # id of the blood bank the levels were parsed from
+
+    def level_of(self, blood_group: str) -> str:
+        return self.levels[BLOOD_GROUPS.index(blood_group)]
+
+    def is_low(self, blood_group: str) -> bool:
+        return self.level_of(blood_group) != ENOUGH
+
+    def new_shortages(self, previous: 'BloodLevels') -> list:
+        """Blood groups that have enough blood in the previous snapshot and are low in this one"""
+
+        return [blood_group for blood_group, level, previous_level in zip(BLOOD_GROUPS, self.levels, previous.levels)
+                if level != ENOUGH and previous_level == ENOUGH]
@@ -0,0 +1,191 @@
+"""Latency histograms, counters and gauges of the bot, exposed in the Prometheus text format"""
+
+import functools
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Histogram:
+    """Latency histogram in seconds, rendered in the Prometheus text format"""
+
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds: float):
+        position = next((number for number, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        with self.lock:
+            self.counts[position] += 1
+            self.sum += seconds
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def render(self) -> list:
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        cumulative = 0
+        for bound, count in zip([*self.buckets, '+Inf'], counts):
+            cumulative += count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines += [f'{self.name}_sum {total}', f'{self.name}_count {cumulative}']
+        return lines
+
+
+class Metric:
+    """Counter (inc) or gauge (set, or a function returning the current value)"""
+
+    def __init__(self, name: str, description: str, kind: str = 'counter', function=None):
+        self.name = name
+        self.description = description
+        self.kind = kind
+        self.function = function
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+    def render(self) -> list:
+        value = self.function() if self.function else self.value
+        return [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} {self.kind}', f'{self.name} {value}']
+
+
+class Metrics:
+    """All the bot's metrics, exposed in the Prometheus text format"""
+
+    def __init__(self):
+        self.instruments = dict()
+        self.page_fetch = self.add(Histogram('donor_bot_page_fetch_seconds', 'Download of a blood bank page'))
+        self.page_parse = self.add(Histogram('donor_bot_page_parse_seconds', 'Extraction of the blood levels'))
+        self.notifier_run = self.add(Histogram('donor_bot_notifier_run_seconds', 'Run of the notifier'))
+        self.telegram_send = self.add(Histogram('donor_bot_telegram_send_seconds', 'Bot API call of the dispatcher'))
+        self.db_write = self.add(Histogram('donor_bot_db_write_seconds', 'Write into the user or history db'))
+        self.notifications_sent = self.add(Metric('donor_bot_notifications_sent_total', 'Notifications delivered'))
+        self.notifications_failed = self.add(Metric('donor_bot_notifications_failed_total',
+                                                    'Notifications that could not be delivered'))
+        self.rescheduled = self.add(Metric('donor_bot_notifications_rescheduled_total', 'Rescheduled notifications'))
+        self.messages_failed = self.add(Metric('donor_bot_messages_failed_total', 'Failed Bot API calls'))
+        self.page_drift = self.add(Metric('donor_bot_page_drift_total',
+                                          'Pages whose blood levels block has an unexpected structure'))
+        self.campaign_messages = self.add(Metric('donor_bot_campaign_messages_total',
+                                                 'Messages delivered by the broadcast campaigns'))
+
+    def add(self, instrument):
+        self.instruments[instrument.name] = instrument
+        return instrument
+
+    def gauge(self, name: str, description: str, function):
+        return self.add(Metric(name, description, 'gauge', function))
+
+    def render(self) -> str:
+        lines = []
+        for instrument in list(self.instruments.values()):
+            try:
+                lines += instrument.render()
+            except Exception as e:  # a gauge whose object is not there yet
+                print(f'Error while rendering {instrument.name}: \n{e}')
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Opt-in profiler: samples the stack of a thread every `interval` seconds and counts the sampled stacks,
+    the report is in the collapsed format understood by flamegraph.pl and speedscope"""
+
+    def __init__(self, thread: threading.Thread, interval: float = 0.01):
+        self.thread = thread
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread.ident)
+        stack = []
+        while frame is not None:
+            stack.append(f'{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        if stack:
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def report(self) -> str:
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common()) + '\n'
+
+
+class MetricsServer:
+    """Local HTTP endpoint: /metrics in the Prometheus text format, /profile with the profiler's stacks"""
+
+    def __init__(self, registry: Metrics, port: int, host: str = '127.0.0.1'):
+        self.registry = registry
+        self.profiler = None
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = server.registry.render()
+                elif self.path == '/profile' and server.profiler is not None:
+                    body = server.profiler.report()
+                else:
+                    return self.send_error(404)
+                payload = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self.http_server = ThreadingHTTPServer((host, port), Handler)
+        self.http_server.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.http_server.serve_forever, daemon=True).start()
+
+
+def measure_execution_time(histogram: Histogram):
+    """Records the execution time of the decorated function into the histogram"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time():
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+metrics = Metrics()
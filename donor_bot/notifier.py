@@ -0,0 +1,125 @@
+"""Decides when the users are notified about the shortages of their blood group"""
+
+import threading
+import time
+
+import telebot
+
+from donor_bot.metrics import measure_execution_time, metrics
+from donor_bot.scheduler import EventScheduler
+from donor_bot.users import UserTable, from_day, today
+
+
+class Notifier:
+    claim_batch = 50  # users claimed at once by a worker process
+    end_of_day = 23  # hour of the run rescheduling the users who weren't notified
+
+    def __init__(self, notify_date, notify_time, json_dict: UserTable, store, registry, dispatcher, shards=None):
+        self.date = notify_date
+        self.time = notify_time
+        self.user_table = json_dict
+        self.store = store  # UserStore
+        self.banks = registry  # BankRegistry
+        self.dispatcher = dispatcher  # MessageDispatcher
+        self.shards = shards  # ShardLeases of a worker process, None if this process notifies all the users
+        self.lock = threading.Lock()
+
+    def reschedule_notification(self, user_id, json_dict: UserTable, delay: int):
+        """Reschedules the notification by a specified period of time (delay)"""
+
+        self.reschedule_group([user_id], json_dict, delay)
+
+    def reschedule_group(self, user_ids, json_dict: UserTable, delay: int):
+        """Reschedules the notifications of several users at once, the changes are committed together"""
+
+        notify_day = today() + delay
+        self.lock.acquire()
+        json_dict.set_notify_day(user_ids, notify_day)
+        self.store.save_field(user_ids, 'notify_date', from_day(notify_day))
+        self.lock.release()
+        metrics.rescheduled.inc(len(user_ids))
+        print(f'{len(user_ids)} notification(s) postponed by {delay} days')
+
+    def notify_the_user(self, user_id):
+        """Sends a notification each monday including the blood centre location"""
+
+        keyboard = telebot.types.InlineKeyboardMarkup()
+        dont_disturb_week = telebot.types.InlineKeyboardButton(text='Нагадай пізніше (Тиждень)',
+                                                               callback_data='add_one_week')
+        dont_disturb_two_months = telebot.types.InlineKeyboardButton(text='Щойно здав :) (Два місяці)',
+                                                                     callback_data='add_two_months')
+        keyboard.row(dont_disturb_week)
+        keyboard.row(dont_disturb_two_months)
+        emoji = u'\U0001F609'
+        incentive_text = 'Не забувай: здача крові це 3 врятованих життя, ' \
+                         f'довідка на 2 вихідних, і чай з печивком {emoji}'
+        return self.dispatcher.send_message(user_id,
+                                            'Привіт! З моменту твоєї останньої донації пройшло більше двох місяців, '
+                                            f'а у {self.banks.bank_of(self.user_table[user_id]).name} закінчується '
+                                            f'{self.user_table[user_id]["blood_type"]} {self.user_table[user_id]["blood_rh"]}'
+                                            f'\n\n{incentive_text}',
+                                            reply_markup=keyboard, bulk=True)
+
+    def notify_group(self, cids: list):
+        """Notifies the users and reschedules them by a week, the users who didn't get a message are retried tomorrow.
+        A worker claims the users in batches of claim_batch, so its crash loses at most a batch of notifications,
+        the users already notified by another worker (e.g. one that has crashed) are only rescheduled"""
+
+        batch_size = len(cids) if self.shards is None else self.claim_batch
+        for start in range(0, len(cids), batch_size):
+            batch, already_sent = cids[start:start + batch_size], []
+            if self.shards is not None:
+                batch, already_sent = self.shards.claim(batch, today())
+            # the messages are sent concurrently
+            deliveries = [(cid, self.notify_the_user(cid)) for cid in batch]
+            failed = {cid for cid, delivery in deliveries if delivery.exception() is not None}
+            metrics.notifications_sent.inc(len(batch) - len(failed))
+            metrics.notifications_failed.inc(len(failed))
+            if self.shards is not None and failed:
+                self.shards.unclaim(failed, today())
+            self.reschedule_group([cid for cid in batch if cid not in failed] + already_sent, self.user_table, 7)
+            if failed:
+                self.reschedule_group(sorted(failed), self.user_table, 1)
+
+    @measure_execution_time(metrics.notifier_run)
+    def decide_when_to_notify(self, groups: set = None, end_of_day: bool = False):
+        """Notifies the due users if blood is low and it is the notification day and hour.
+        The users left are rescheduled by a day only by the end_of_day run, until then they stay due,
+        so that a blood group running short later in the day still finds its users.
+        groups limits the run to some (bank, blood group) pairs, e.g. the ones that have just run short.
+        A worker process only handles the chats of the shards it holds"""
+
+        if self.shards is not None:
+            # the bot and the other workers write to the store, the users due are read again
+            self.user_table = self.store.load_due(today())
+        due_today = self.user_table.due(today())
+        if groups is not None:
+            due_today = {group: cids for group, cids in due_today.items() if group in groups}
+        if self.shards is not None:
+            due_today = {group: [cid for cid in cids if self.shards.owns(cid)] for group, cids in due_today.items()}
+            due_today = {group: cids for group, cids in due_today.items() if cids}
+        if not due_today:
+            return
+        notify_now = time.strftime('%a') == self.date and time.strftime('%H') == self.time
+        snapshots = dict()  # the same blood levels of a bank are used for the whole run
+        for (bank_id, blood_group), cids in due_today.items():
+            cids = sorted(cids)
+            if notify_now and bank_id not in snapshots:
+                try:
+                    snapshots[bank_id] = self.banks.snapshot(bank_id, fresh=True)  # no alerts on old levels
+                except Exception as e:
+                    snapshots[bank_id] = None
+                    print(f'No usable blood levels of {bank_id}, its users are not notified: \n{e}')
+            if notify_now and snapshots[bank_id] is not None and snapshots[bank_id].is_low(blood_group):
+                self.notify_group(cids)
+            elif end_of_day:
+                self.reschedule_group(cids, self.user_table, 1)
+
+    def schedule_runs(self, event_scheduler: EventScheduler):
+        """The weekly run at the notification hour sends the notifications,
+        the run at the end of every day reschedules the users due that day who weren't notified"""
+
+        weekdays = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+        event_scheduler.call_soon(self.decide_when_to_notify)
+        event_scheduler.call_daily(self.decide_when_to_notify, int(self.time), weekdays.index(self.date))
+        event_scheduler.call_daily(lambda: self.decide_when_to_notify(end_of_day=True), self.end_of_day)
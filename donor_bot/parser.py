@@ -0,0 +1,278 @@
+"""Downloads the blood banks' pages and keeps the latest snapshot of their blood levels"""
+
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import NamedTuple
+
+import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+
+from donor_bot.levels import BLOOD_GROUPS, DEFAULT_BANK, LEVELS, BloodLevels
+from donor_bot.metrics import metrics
+
+
+class StructureDriftError(ValueError):
+    """The blood levels block of the page doesn't look as expected, the levels can't be trusted"""
+
+
+class NoSnapshotError(LookupError):
+    """The page hasn't been downloaded yet, neither by this process nor by the previous one"""
+
+
+class StaleSnapshotError(NoSnapshotError):
+    """The page hasn't been checked for too long, its levels aren't used for the alerts"""
+
+
+def blood_group_of(label: str):
+    """'II (–)' -> 'II(-)', None if the text isn't a blood group label"""
+
+    if not label or len(label) > 16:
+        return None
+    group = ''.join(label.split()).replace('\u2013', '-').replace('\u2014', '-').replace('\u2212', '-')
+    return group if group in BLOOD_GROUPS else None
+
+
+class Parser:
+    """Downloads the page and extracts the blood levels from it.
+    Blood banks with differently structured pages get a subclass overriding extract_blood_levels()"""
+
+    chunk_size = 8192  # bytes of the streamed page fed to the parser at once
+    known_levels = LEVELS  # any other text in place of a level means that the page has changed
+
+    # headers are necessary to emulate a 'live user' connection, otherwise produces an error
+    page_headers = {
+        'User-Agent':
+            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) snap Chromium/81.0.4044.138 Chrome/81.0.4044.138 Safari/537.36"
+    }
+
+    def __init__(self, url: str, tag: str, timeout: int = 15, bank_id: str = DEFAULT_BANK):
+        self.page_url = url
+        self.tag = tag
+        self.timeout = timeout  # a slow site fails on its own without delaying the other banks
+        self.bank_id = bank_id
+        self.session = requests.Session()  # keeps the connection to the site alive between the downloads
+
+    def download_a_page(self, etag: str = None, last_modified: str = None):
+        """Downloads the page, the server answers with 304 if it hasn't changed since the previous download"""
+
+        headers = dict(self.page_headers)
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        with metrics.page_fetch.time():
+            # the body is streamed into the parser by extract_blood_levels()
+            return self.session.get(self.page_url, headers=headers, timeout=self.timeout, stream=True)
+
+    def extract_blood_levels(self, page, encoding: str = None) -> BloodLevels:
+        """Streams the page (the html or an iterable of its chunks) into lxml's incremental parser. Each level
+        (the text of a self.tag element) goes to the blood group labelled right before it, so another self.tag
+        on the page can't shift the groups, and the parsing stops once all the groups are found.
+        Raises StructureDriftError if a group is missing or labelled twice, if a second self.tag follows the level
+        of a group, or if a level isn't one of known_levels"""
+
+        levels = dict()  # blood group -> level
+        label = None  # the blood group whose level comes next
+        last_level = None  # the blood group whose level has just been read, no other self.tag may follow it
+        parser = etree.HTMLPullParser(events=('end',), encoding=encoding)
+        with metrics.page_parse.time():
+            for chunk in ([page] if isinstance(page, (str, bytes)) else page):
+                parser.feed(chunk)
+                for _, element in parser.read_events():
+                    if element.tag == self.tag and label is not None:
+                        if label in levels:
+                            raise StructureDriftError(f'{label} is labelled twice on {self.page_url}')
+                        levels[label] = ' '.join(''.join(element.itertext()).split())
+                        label, last_level = None, label
+                    elif blood_group_of(element.text) is not None:
+                        label, last_level = blood_group_of(element.text), None
+                    elif element.tag == self.tag and last_level is not None:
+                        raise StructureDriftError(f'Another {self.tag} follows the level of {last_level} '
+                                                  f'on {self.page_url}')
+                    element.clear()  # the elements that have been looked at aren't kept in memory
+                    if len(levels) == len(BLOOD_GROUPS):
+                        break  # the rest of the page (e.g. the news) isn't looked at
+                if len(levels) == len(BLOOD_GROUPS):
+                    break
+        missing = [blood_group for blood_group in BLOOD_GROUPS if blood_group not in levels]
+        if missing:
+            raise StructureDriftError(f'No levels of {", ".join(missing)} on {self.page_url}')
+        known = {level.lower() for level in self.known_levels}
+        unexpected = {group: level for group, level in levels.items() if level.lower() not in known}
+        if unexpected:
+            raise StructureDriftError(f'Unexpected levels {unexpected} on {self.page_url}')
+        return BloodLevels(datetime.date.today(), tuple(levels[group] for group in BLOOD_GROUPS), self.bank_id)
+
+
+class SnapshotCache:
+    """Keeps the latest blood levels snapshot in memory, refresh() is called by the scheduler every ttl seconds,
+    readers get the current snapshot without touching the network"""
+
+    def __init__(self, page_parser: Parser, ttl: int = 600):
+        self.parser = page_parser
+        self.ttl = ttl  # seconds between two checks of the page
+        self.snapshot = None
+        self.etag = None
+        self.last_modified = None
+        self.checked_at = 0.0  # time.time() of the last successful check, saved with the snapshot
+        self.lock = threading.Lock()
+        self.listeners = []  # called with every newly parsed snapshot
+        self.drift = None  # StructureDriftError of the latest download, the levels aren't served while it's set
+        self.drift_listeners = []  # called with the error when the page stops looking as expected
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def subscribe_drift(self, callback):
+        self.drift_listeners.append(callback)
+
+    def refresh(self) -> BloodLevels:
+        """Checks the page, an unchanged page costs a single 304 response and keeps the snapshot as is"""
+
+        with self.lock:
+            if self.snapshot is None:
+                response = self.parser.download_a_page()
+            else:
+                response = self.parser.download_a_page(self.etag, self.last_modified)
+            if response.status_code != 304:
+                response.raise_for_status()
+                try:
+                    snapshot = self.parse(response)
+                finally:
+                    response.close()  # the rest of the page isn't needed
+                self.etag = response.headers.get('ETag')
+                self.last_modified = response.headers.get('Last-Modified')
+            else:
+                # unchanged since the last parsed page, but checked today: a drift seen in between is over
+                snapshot = self.snapshot._replace(date=datetime.date.today())
+                self.drift = None
+            self.checked_at = time.time()  # before the listeners, which save it with the snapshot
+            if snapshot != self.snapshot:  # an equal snapshot is kept, so that its readers' caches stay valid
+                self.snapshot = snapshot
+                for callback in self.listeners:
+                    try:
+                        callback(self.snapshot)
+                    except Exception as e:
+                        print(f'Error in a blood levels listener: \n{e}')
+            return self.snapshot
+
+    def parse(self, response) -> BloodLevels:
+        """Extracts the levels from the streamed response, the listeners learn about a drift once"""
+
+        # without a charset in Content-Type lxml takes the one declared by the page
+        encoding = response.encoding if 'charset' in response.headers.get('Content-Type', '') else None
+        try:
+            snapshot = self.parser.extract_blood_levels(response.iter_content(self.parser.chunk_size), encoding)
+        except StructureDriftError as e:
+            metrics.page_drift.inc()
+            if self.drift is None or str(self.drift) != str(e):
+                for callback in self.drift_listeners:
+                    try:
+                        callback(e)
+                    except Exception as error:
+                        print(f'Error in a page drift listener: \n{error}')
+            self.drift = e
+            raise
+        self.drift = None
+        return snapshot
+
+    def is_stale(self) -> bool:
+        """The snapshot is stale when the background refresh has missed more than one check"""
+
+        return time.time() - self.checked_at > 2 * self.ttl
+
+    def current(self, fresh: bool = False) -> BloodLevels:
+        """Returns the latest snapshot without touching the network: only the scheduler's refresh() downloads
+        the page. A stale one is returned too while the site is down, unless a fresh one is asked for
+        (the alerts are only sent on the levels checked within the last two ttls)"""
+
+        if self.drift is not None:
+            raise self.drift  # no levels rather than possibly shifted ones
+        if self.snapshot is None:
+            raise NoSnapshotError(f'No blood levels of {self.parser.bank_id} have been downloaded yet')
+        if fresh and self.is_stale():
+            raise StaleSnapshotError(f'The blood levels of {self.parser.bank_id} were last checked '
+                                     f'{(time.time() - self.checked_at) / 60:.0f} minutes ago')
+        return self.snapshot
+
+
+class BloodBank(NamedTuple):
+    bank_id: str
+    name: str  # used in the messages: 'у {name} закінчується ...'
+    location: tuple  # latitude, longitude
+
+
+class BankRegistry:
+    """Blood banks known to the bot, each one with its own parser and snapshot cache.
+    The pages are refreshed concurrently over a shared pool of HTTP connections"""
+
+    def __init__(self, pool_size: int = 50):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.banks = dict()  # bank id -> BloodBank
+        self.caches = dict()  # bank id -> SnapshotCache
+
+    def register(self, bank: BloodBank, page_parser: Parser, ttl: int = 600) -> SnapshotCache:
+        page_parser.bank_id = bank.bank_id
+        page_parser.session = self.session
+        self.banks[bank.bank_id] = bank
+        self.caches[bank.bank_id] = SnapshotCache(page_parser, ttl)
+        return self.caches[bank.bank_id]
+
+    def bank_of(self, record: dict) -> BloodBank:
+        return self.banks.get(record.get('bank') or DEFAULT_BANK, self.banks[DEFAULT_BANK])
+
+    def snapshot(self, bank_id: str = DEFAULT_BANK, fresh: bool = False) -> BloodLevels:
+        return self.caches[bank_id].current(fresh)
+
+    def refresh_all(self) -> dict:
+        """Refreshes all the banks at once, takes about as long as the slowest site.
+        Returns bank id -> snapshot, the banks whose refresh failed keep their previous snapshot"""
+
+        snapshots = dict()
+        with ThreadPoolExecutor(max_workers=max(1, len(self.caches))) as executor:
+            futures = {executor.submit(cache.refresh): bank_id for bank_id, cache in self.caches.items()}
+            wait(futures)
+        for future, bank_id in futures.items():
+            if future.exception() is not None:
+                print(f'Error while refreshing the blood levels of {bank_id}: \n{future.exception()}')
+            snapshots[bank_id] = self.caches[bank_id].snapshot
+        return snapshots
+
+    def ttl(self) -> int:
+        return min(cache.ttl for cache in self.caches.values())
+
+    def save_snapshots(self, path: str):
+        """Saves the latest snapshot of every bank, the next start serves them before the first refresh"""
+
+        saved = {bank_id: {'date': str(cache.snapshot.date), 'levels': cache.snapshot.levels,
+                           'etag': cache.etag, 'last_modified': cache.last_modified, 'checked_at': cache.checked_at}
+                 for bank_id, cache in self.caches.items() if cache.snapshot is not None}
+        temporary = f'{path}.{os.getpid()}.tmp'  # the worker processes save the same file
+        with open(temporary, 'w') as json_file:
+            json.dump(saved, json_file, ensure_ascii=False)
+        os.replace(temporary, path)  # a crash while writing leaves the previous file intact
+
+    def load_snapshots(self, path: str) -> int:
+        """Loads the snapshots saved by save_snapshots(), returns how many banks got one"""
+
+        try:
+            with open(path) as json_file:
+                saved = json.load(json_file)
+        except (FileNotFoundError, ValueError):
+            return 0
+        for bank_id, snapshot in saved.items():
+            if bank_id in self.caches:
+                cache = self.caches[bank_id]
+                cache.snapshot = BloodLevels(datetime.date.fromisoformat(snapshot['date']),
+                                             tuple(snapshot['levels']), bank_id)
+                cache.etag, cache.last_modified = snapshot['etag'], snapshot['last_modified']
+                cache.checked_at = snapshot.get('checked_at', 0.0)  # stale until refreshed if it's too old
+        return len(set(saved) & set(self.caches))
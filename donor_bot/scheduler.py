@@ -0,0 +1,77 @@
+"""Min-heap scheduler running the bot's background work"""
+
+import datetime
+import heapq
+import itertools
+import threading
+import time
+
+
+class EventScheduler:
+    """Keeps the upcoming events in a min-heap ordered by due time and sleeps exactly until the next one is due.
+    An error in an event is printed and the loop carries on with the next event"""
+
+    def __init__(self):
+        self.heap = []  # (due time as time.time(), sequence number, callback)
+        self.sequence = itertools.count()  # events due at the same time run in the order they were added
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = None
+
+    def call_at(self, when: float, callback):
+        with self.condition:
+            heapq.heappush(self.heap, (when, next(self.sequence), callback))
+            self.condition.notify()
+
+    def call_soon(self, callback):
+        self.call_at(time.time(), callback)
+
+    def call_every(self, seconds: float, callback):
+        """Runs the callback now and then every `seconds`"""
+
+        def run():
+            self.call_at(time.time() + seconds, run)
+            callback()
+
+        self.call_soon(run)
+
+    @staticmethod
+    def next_occurrence(hour: int, weekday: int = None) -> float:
+        """Next start of the hour, on the given weekday (Monday = 0) if there is one"""
+
+        now = datetime.datetime.now()
+        moment = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+        while moment <= now or (weekday is not None and moment.weekday() != weekday):
+            moment += datetime.timedelta(days=1)
+        return moment.timestamp()
+
+    def call_daily(self, callback, hour: int = 0, weekday: int = None):
+        """Runs the callback every day at the start of the hour, or once a week if the weekday is given"""
+
+        def run():
+            self.call_at(self.next_occurrence(hour, weekday), run)
+            callback()
+
+        self.call_at(self.next_occurrence(hour, weekday), run)
+
+    def run(self):
+        while 1:
+            with self.condition:
+                while not self.stopped and (not self.heap or self.heap[0][0] > time.time()):
+                    self.condition.wait(self.heap[0][0] - time.time() if self.heap else None)
+                if self.stopped:
+                    return
+                _, _, callback = heapq.heappop(self.heap)
+            try:
+                callback()
+            except Exception as e:
+                print(f'Error in the background thread: \n{e}')
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        return self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
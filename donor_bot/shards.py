@@ -0,0 +1,106 @@
+"""Sharded notifications: the chats are split into shards by chat id, each shard is notified by the worker
+process holding its lease. The leases and the sent markers are kept in the user store, shared by the processes"""
+
+import math
+import os
+import socket
+import time
+
+from donor_bot.store import UserStore
+
+
+class ShardLeases:
+    """Leases of the notification shards held by one worker. Every renew() extends the worker's leases,
+    gives up the shards over its fair share (a new worker has joined) and takes over the free ones,
+    including the shards of a worker that has stopped renewing (crashed) once their lease has expired.
+    A notification is sent only after claim() has stored its send-once marker, so a user gets one alert per
+    scheduled day even if two workers have processed the same shard"""
+
+    def __init__(self, store: UserStore, shards: int, worker_id: str = None, lease: float = 60):
+        self.store = store
+        self.shards = shards
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease = lease  # seconds a lease lasts without renewal
+        self.held = frozenset()
+        with store.batch():
+            store.connection.execute('CREATE TABLE IF NOT EXISTS shard_leases ('
+                                     'shard INTEGER PRIMARY KEY, owner TEXT, expires_at REAL)')
+            store.connection.execute('CREATE TABLE IF NOT EXISTS notifier_workers ('
+                                     'worker_id TEXT PRIMARY KEY, seen_at REAL)')
+            store.connection.execute('CREATE TABLE IF NOT EXISTS notification_sent ('
+                                     'chat_id TEXT, notify_day INTEGER, worker_id TEXT, sent_at REAL, '
+                                     'PRIMARY KEY (chat_id, notify_day))')
+            store.connection.executemany('INSERT OR IGNORE INTO shard_leases VALUES (?, NULL, 0)',
+                                         [(shard,) for shard in range(shards)])
+
+    def shard_of(self, chat_id) -> int:
+        return int(chat_id) % self.shards
+
+    def renew(self) -> frozenset:
+        """Renews, releases and takes the leases, returns the shards held until the next renewal"""
+
+        now = time.time()
+        connection = self.store.connection
+        with self.store.batch():
+            connection.execute('INSERT OR REPLACE INTO notifier_workers VALUES (?, ?)', (self.worker_id, now))
+            connection.execute('DELETE FROM notifier_workers WHERE seen_at < ?', (now - self.lease,))
+            alive = connection.execute('SELECT count(*) FROM notifier_workers').fetchone()[0]
+            fair_share = math.ceil(self.shards / alive)
+            leases = connection.execute('SELECT shard, owner, expires_at FROM shard_leases '
+                                        'WHERE shard < ? ORDER BY shard', (self.shards,)).fetchall()
+            mine = [shard for shard, owner, expires_at in leases if owner == self.worker_id and expires_at > now]
+            free = [shard for shard, owner, expires_at in leases if owner is None or expires_at <= now]
+            held = mine[:fair_share] + free[:max(0, fair_share - len(mine))]
+            connection.executemany('UPDATE shard_leases SET owner = NULL, expires_at = 0 WHERE shard = ?',
+                                   [(shard,) for shard in mine[fair_share:]])
+            connection.executemany('UPDATE shard_leases SET owner = ?, expires_at = ? WHERE shard = ?',
+                                   [(self.worker_id, now + self.lease, shard) for shard in held])
+        if set(held) != self.held:
+            print(f'Worker {self.worker_id} holds the shards {sorted(held)} of {self.shards}')
+        self.held = frozenset(held)
+        return self.held
+
+    def release(self):
+        """Gives up all the leases at once, e.g. on a clean shutdown"""
+
+        with self.store.batch():
+            self.store.connection.execute('UPDATE shard_leases SET owner = NULL, expires_at = 0 WHERE owner = ?',
+                                          (self.worker_id,))
+            self.store.connection.execute('DELETE FROM notifier_workers WHERE worker_id = ?', (self.worker_id,))
+        self.held = frozenset()
+
+    def owns(self, chat_id) -> bool:
+        return self.shard_of(chat_id) in self.held
+
+    def claim(self, chat_ids, notify_day: int) -> tuple:
+        """Stores the send-once markers of the chats whose shard's lease is still held (checked in the same
+        transaction). Returns the chats this worker may notify and the ones already notified for the day,
+        the chats of the shards taken over by another worker are in neither list"""
+
+        now = time.time()
+        claimed, already_sent = [], []
+        connection = self.store.connection
+        with self.store.batch():
+            valid = {shard for shard, in connection.execute('SELECT shard FROM shard_leases '
+                                                             'WHERE owner = ? AND expires_at > ?',
+                                                             (self.worker_id, now))}
+            for chat_id in chat_ids:
+                if self.shard_of(chat_id) not in valid:
+                    continue
+                inserted = connection.execute('INSERT OR IGNORE INTO notification_sent VALUES (?, ?, ?, ?)',
+                                              (str(chat_id), notify_day, self.worker_id, now))
+                (claimed if inserted.rowcount else already_sent).append(chat_id)
+        return claimed, already_sent
+
+    def unclaim(self, chat_ids, notify_day: int):
+        """Removes the markers of the notifications that couldn't be delivered"""
+
+        with self.store.batch():
+            self.store.connection.executemany(
+                'DELETE FROM notification_sent WHERE chat_id = ? AND notify_day = ? AND worker_id = ?',
+                [(str(chat_id), notify_day, self.worker_id) for chat_id in chat_ids])
+
+    def forget_before(self, day: int) -> int:
+        with self.store.batch():
+            return self.store.connection.execute('DELETE FROM notification_sent WHERE notify_day < ?',
+                                                 (day,)).rowcount
@@ -0,0 +1,162 @@
+"""Persistent user table and onboarding sessions, kept in SQLite"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from donor_bot.metrics import metrics
+from donor_bot.users import UserTable, from_day
+
+
+class UserStore:
+    """Keeps the users in a SQLite database in WAL mode, a change writes only the rows of the changed users"""
+
+    fields = ('blood_type', 'blood_rh', 'last_donated', 'bot_stage', 'notify_date', 'bank')
+
+    def __init__(self, path: str):
+        # autocommit mode, the transactions are opened explicitly by batch()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')  # WAL stays consistent after a crash in this mode
+        self.connection.execute('CREATE TABLE IF NOT EXISTS users ('
+                                'chat_id TEXT PRIMARY KEY, blood_type TEXT, blood_rh TEXT, '
+                                'last_donated TEXT, bot_stage INTEGER, notify_date TEXT, bank TEXT)')
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(users)')]
+        if 'bank' not in columns:  # stores created before the users were linked to the banks
+            self.connection.execute('ALTER TABLE users ADD COLUMN bank TEXT')
+        # the worker processes load only the users due (load_due), a few per cent of the table
+        self.connection.execute('CREATE INDEX IF NOT EXISTS users_notify_date ON users (notify_date)')
+        self.lock = threading.RLock()
+        self.depth = 0  # number of nested batch() blocks
+
+    @contextmanager
+    def batch(self):
+        """Groups all the writes made inside the block into a single transaction (and a single commit).
+        The write lock is taken at the start, so the transactions of several processes queue up instead of failing"""
+
+        with self.lock:
+            if self.depth == 0:
+                self.connection.execute('BEGIN IMMEDIATE')
+            self.depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.execute('ROLLBACK')
+                raise
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.connection.execute('COMMIT')
+
+    def save(self, user_id: str, record: dict):
+        self.save_many({user_id: record})
+
+    def save_many(self, records: dict):
+        with metrics.db_write.time(), self.batch():
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO users (chat_id, %s) VALUES (?, %s)'
+                % (', '.join(self.fields), ', '.join('?' * len(self.fields))),
+                [(str(cid), *(record.get(field) for field in self.fields)) for cid, record in records.items()])
+
+    def save_field(self, chat_ids, field: str, value):
+        """Writes a single column of the users, leaving the columns changed by other processes as they are"""
+
+        if field not in self.fields:
+            raise KeyError(field)
+        with metrics.db_write.time(), self.batch():
+            self.connection.executemany('UPDATE users SET %s = ? WHERE chat_id = ?' % field,
+                                        [(value, str(cid)) for cid in chat_ids])
+
+    def load_all(self) -> UserTable:
+        with self.lock:
+            rows = self.connection.execute('SELECT chat_id, %s FROM users' % ', '.join(self.fields)).fetchall()
+        table = UserTable(len(rows))
+        table.extend(rows)
+        return table
+
+    def load_due(self, day: int) -> UserTable:
+        """The users whose notify date is the day or has passed, the ISO dates compare as text"""
+
+        with self.lock:
+            rows = self.connection.execute('SELECT chat_id, %s FROM users WHERE notify_date <= ?'
+                                           % ', '.join(self.fields), (from_day(day),)).fetchall()
+        table = UserTable(len(rows))
+        table.extend(rows)
+        return table
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.connection.execute('SELECT 1 FROM users LIMIT 1').fetchone() is None
+
+    def migrate_from_json(self, json_path: str):
+        """One-shot import of the old user-table.json, does nothing once the store has any users"""
+
+        if not self.is_empty():
+            return
+        try:
+            with open(json_path, 'r') as json_file:
+                records = json.load(json_file)
+        except FileNotFoundError:
+            return
+        self.save_many(records)
+        print(f'{len(records)} users migrated from {json_path}')
+
+    def export_json(self, json_path: str):
+        """Writes the users in the old user-table.json format"""
+
+        with open(json_path, 'w') as json_file:
+            json.dump(self.load_all().to_json(), json_file, indent=4)
+
+
+class OnboardingSession(NamedTuple):
+    stage: int  # the same values as bot_stage: 0 - waits for the blood type, 1 - for the Rh, 2 - for the last donation
+    blood_type: str
+    blood_rh: str
+    updated_at: float
+
+
+class Onboarding:
+    """Finite-state machine of the /start dialog keyed by chat id, the answers given so far are kept in the
+    user store instead of the memory, so the sessions survive a restart. Abandoned sessions expire after ttl"""
+
+    def __init__(self, store: UserStore, ttl: int = 24 * 3600):
+        self.store = store
+        self.ttl = ttl
+        with store.lock:
+            store.connection.execute('CREATE TABLE IF NOT EXISTS onboarding ('
+                                     'chat_id TEXT PRIMARY KEY, stage INTEGER, blood_type TEXT, blood_rh TEXT, '
+                                     'updated_at REAL)')
+
+    def get(self, chat_id):
+        """Returns the unexpired session of the chat or None"""
+
+        with self.store.lock:
+            row = self.store.connection.execute('SELECT stage, blood_type, blood_rh, updated_at FROM onboarding '
+                                                'WHERE chat_id = ?', (str(chat_id),)).fetchone()
+        if row is None or row[3] < time.time() - self.ttl:
+            return None
+        return OnboardingSession(*row)
+
+    def advance(self, chat_id, stage: int, blood_type: str = None, blood_rh: str = None):
+        """Moves the chat to the stage, the answers that are not passed are kept"""
+
+        with self.store.batch():
+            self.store.connection.execute(
+                'INSERT INTO onboarding VALUES (?, ?, ?, ?, ?) ON CONFLICT(chat_id) DO UPDATE SET '
+                'stage = excluded.stage, blood_type = coalesce(excluded.blood_type, blood_type), '
+                'blood_rh = coalesce(excluded.blood_rh, blood_rh), updated_at = excluded.updated_at',
+                (str(chat_id), stage, blood_type, blood_rh, time.time()))
+
+    def finish(self, chat_id):
+        with self.store.batch():
+            self.store.connection.execute('DELETE FROM onboarding WHERE chat_id = ?', (str(chat_id),))
+
+    def evict_expired(self) -> int:
+        with self.store.batch():
+            return self.store.connection.execute('DELETE FROM onboarding WHERE updated_at < ?',
+                                                 (time.time() - self.ttl,)).rowcount
@@ -0,0 +1,256 @@
+"""Users who have finished the onboarding, kept as numpy columns (struct of arrays) instead of a dict per user.
+A user takes about 30 bytes: the blood type, the Rh, the stage and the bank are small ints, the dates are day
+ordinals, so the date checks are integer comparisons over a whole column"""
+
+import datetime
+import threading
+
+import numpy as np
+
+from donor_bot.levels import DEFAULT_BANK
+
+BLOOD_TYPES = ('I', 'II', 'III', 'IV')
+BLOOD_RHS = ('(+)', '(-)')
+UNKNOWN = -1  # the blood type or Rh hasn't been given
+NO_DATE = 0  # day ordinals start with 1 (0001-01-01)
+
+
+def to_day(date) -> int:
+    """Day ordinal of an ISO date (the JSON format), a date or an ordinal"""
+
+    if date is None:
+        return NO_DATE
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+    return date if isinstance(date, int) else date.toordinal()
+
+
+def from_day(day: int):
+    return None if day == NO_DATE else str(datetime.date.fromordinal(day))
+
+
+def today() -> int:
+    return datetime.date.today().toordinal()
+
+
+class UserRecord:
+    """A user of the UserTable, read and written like a record of the JSON user table"""
+
+    __slots__ = ('table', 'row')
+
+    def __init__(self, table: 'UserTable', row: int):
+        self.table = table
+        self.row = row
+
+    def __getitem__(self, field: str):
+        return self.table.decode(field, self.row)
+
+    def __setitem__(self, field: str, value):
+        with self.table.lock:
+            self.table.encode(field, self.row, value)
+
+    def get(self, field: str, default=None):
+        return self[field] if field in self.table.fields else default
+
+    def update(self, **fields):
+        with self.table.lock:
+            for field, value in fields.items():
+                self.table.encode(field, self.row, value)
+
+    @property
+    def notify_day(self) -> int:
+        return int(self.table.notify_date[self.row])
+
+    @property
+    def blood_group(self) -> str:
+        return f'{self["blood_type"]}{self["blood_rh"]}'
+
+    def to_json(self) -> dict:
+        return {field: self[field] for field in self.table.fields}
+
+
+class UserTable:
+    """Chat id -> user, one numpy column per field. The chat ids are found by bisection in a sorted copy
+    of the chat_id column, the users added since the last sort are kept in a small dict.
+    Writes hold the lock, reads don't: a column is only replaced by a bigger copy"""
+
+    fields = ('blood_type', 'blood_rh', 'last_donated', 'bot_stage', 'notify_date', 'bank')
+    dtypes = {'chat_id': np.int64, 'blood_type': np.int8, 'blood_rh': np.int8, 'last_donated': np.int32,
+              'bot_stage': np.uint8, 'notify_date': np.int32, 'bank': np.uint8}
+
+    def __init__(self, capacity: int = 1024):
+        self.size = 0
+        for name, dtype in self.dtypes.items():
+            setattr(self, name, np.zeros(max(capacity, 1), dtype))
+        self.bank_ids = [DEFAULT_BANK]  # bank column -> bank id, a missing bank is the default one
+        self.lookup = (np.empty(0, np.int64), np.empty(0, np.int64))  # sorted chat ids, their rows
+        self.recent = dict()  # chat id -> row of the users added after the lookup was sorted
+        self.lock = threading.RLock()
+
+    @classmethod
+    def from_json(cls, records: dict) -> 'UserTable':
+        """Table of the records in the user-table.json format (str chat id -> dict)"""
+
+        table = cls(len(records))
+        table.extend((cid, *(record.get(field) for field in cls.fields)) for cid, record in records.items())
+        return table
+
+    def to_json(self) -> dict:
+        return {str(chat_id): record.to_json() for chat_id, record in self.items()}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, chat_id) -> bool:
+        return self.row_of(chat_id) is not None
+
+    def __iter__(self):
+        return iter(self.chat_id[:self.size].tolist())
+
+    def __getitem__(self, chat_id) -> UserRecord:
+        row = self.row_of(chat_id)
+        if row is None:
+            raise KeyError(chat_id)
+        return UserRecord(self, row)
+
+    def get(self, chat_id, default=None):
+        row = self.row_of(chat_id)
+        return default if row is None else UserRecord(self, row)
+
+    def items(self):
+        return ((chat_id, UserRecord(self, row)) for row, chat_id in enumerate(self.chat_id[:self.size].tolist()))
+
+    def __setitem__(self, chat_id, record: dict):
+        """Adds or replaces the user, the record is in the JSON format (dates may also be day ordinals)"""
+
+        with self.lock:
+            row = self.row_of(chat_id)
+            if row is None:
+                row = self.append(int(chat_id))
+            for field in self.fields:
+                self.encode(field, row, record.get(field))
+
+    def row_of(self, chat_id):
+        chat_id = int(chat_id)
+        row = self.recent.get(chat_id)  # read before the lookup, which is replaced before the dict is cleared
+        if row is not None:
+            return row
+        chat_ids, rows = self.lookup
+        position = chat_ids.searchsorted(chat_id)
+        if position < len(chat_ids) and chat_ids[position] == chat_id:
+            return int(rows[position])
+        return None
+
+    def append(self, chat_id: int) -> int:
+        """A new row for the chat id, its fields are empty"""
+
+        with self.lock:
+            self.reserve(self.size + 1)
+            row = self.size
+            self.chat_id[row] = chat_id
+            for field in self.fields:
+                getattr(self, field)[row] = UNKNOWN if field in ('blood_type', 'blood_rh') else 0
+            self.size += 1
+            self.recent[chat_id] = row
+            if len(self.recent) > max(256, self.size // 16):
+                self.sort_lookup()
+            return row
+
+    def extend(self, rows):
+        """Appends (chat id, *fields) tuples of new users in the JSON format at once"""
+
+        rows = list(rows)
+        with self.lock:
+            self.reserve(self.size + len(rows))
+            start, end = self.size, self.size + len(rows)
+            columns = list(zip(*rows)) or [()] * (len(self.fields) + 1)
+            self.chat_id[start:end] = [int(chat_id) for chat_id in columns[0]]
+            codes = {'blood_type': {value: code for code, value in enumerate(BLOOD_TYPES)},
+                     'blood_rh': {value: code for code, value in enumerate(BLOOD_RHS)}}
+            days = dict()  # a table has few distinct dates, each one is parsed once
+            for field, values in zip(self.fields, columns[1:]):
+                if field in codes:
+                    encoded = [codes[field].get(value, UNKNOWN) for value in values]
+                elif field in ('last_donated', 'notify_date'):
+                    encoded = [days[value] if value in days else days.setdefault(value, to_day(value))
+                               for value in values]
+                elif field == 'bank':
+                    encoded = [self.bank_code(value) for value in values]
+                else:
+                    encoded = [value or 0 for value in values]
+                getattr(self, field)[start:end] = encoded
+            self.size = end
+            self.sort_lookup()
+
+    def reserve(self, capacity: int):
+        if capacity <= len(self.chat_id):
+            return
+        capacity = max(capacity, 2 * len(self.chat_id))
+        for name in self.dtypes:
+            column = np.zeros(capacity, self.dtypes[name])
+            column[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, column)
+
+    def sort_lookup(self):
+        order = self.chat_id[:self.size].argsort(kind='stable')
+        self.lookup = (self.chat_id[:self.size][order], order)
+        self.recent = dict()
+
+    def bank_code(self, bank_id) -> int:
+        if bank_id is None:
+            return 0
+        if bank_id not in self.bank_ids:
+            self.bank_ids.append(bank_id)
+        return self.bank_ids.index(bank_id)
+
+    def encode(self, field: str, row: int, value):
+        if field == 'blood_type':
+            code = UNKNOWN if value is None else BLOOD_TYPES.index(value)
+        elif field == 'blood_rh':
+            code = UNKNOWN if value is None else BLOOD_RHS.index(value)
+        elif field in ('last_donated', 'notify_date'):
+            code = to_day(value)
+        elif field == 'bank':
+            code = self.bank_code(value)
+        elif field == 'bot_stage':
+            code = value or 0
+        else:
+            raise KeyError(field)
+        getattr(self, field)[row] = code
+
+    def decode(self, field: str, row: int):
+        code = int(getattr(self, field)[row])
+        if field == 'blood_type':
+            return None if code == UNKNOWN else BLOOD_TYPES[code]
+        if field == 'blood_rh':
+            return None if code == UNKNOWN else BLOOD_RHS[code]
+        if field in ('last_donated', 'notify_date'):
+            return from_day(code)
+        if field == 'bank':
+            return self.bank_ids[code]
+        return code
+
+    def set_notify_day(self, chat_ids, day: int):
+        rows = [self.row_of(chat_id) for chat_id in chat_ids]
+        with self.lock:
+            self.notify_date[rows] = day
+
+    def due(self, day: int) -> dict:
+        """Users to be notified on the day grouped by (bank, blood group), one comparison over the whole column.
+        The users whose day has passed are due too, e.g. when the end of day run was missed.
+        The users sent back to /start (bot_stage 0) aren't notified until they finish it again"""
+
+        size = self.size
+        rows = np.flatnonzero((self.notify_date[:size] <= day) & (self.notify_date[:size] != NO_DATE)
+                              & (self.blood_type[:size] != UNKNOWN)
+                              & (self.blood_rh[:size] != UNKNOWN) & (self.bot_stage[:size] == 3))
+        groups = (self.bank[rows].astype(np.int64) * len(BLOOD_TYPES) + self.blood_type[rows]) * len(BLOOD_RHS) \
+            + self.blood_rh[rows]
+        chat_ids = self.chat_id[rows]
+        due = dict()
+        for group in np.unique(groups).tolist():
+            bank, blood = divmod(group, len(BLOOD_TYPES) * len(BLOOD_RHS))
+            blood_type, blood_rh = divmod(blood, len(BLOOD_RHS))
+            key = (self.bank_ids[bank], f'{BLOOD_TYPES[blood_type]}{BLOOD_RHS[blood_rh]}')
+            due[key] = chat_ids[groups == group].tolist()
+        return due
@@ -0,0 +1,147 @@
+"""Webhook mode: the updates pushed by Telegram are handled by a pool of workers"""
+
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import telebot
+
+
+class UpdatePool:
+    """Runs the bot's handlers for the incoming updates in a pool of workers.
+    Updates of the same chat go to the same worker and are processed in the order they came in"""
+
+    def __init__(self, bot: telebot.TeleBot, workers: int = 8, queue_size: int = 500):
+        self.bot = bot
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.latencies = deque(maxlen=10000)  # seconds from receiving an update till its handlers have finished
+        self.processed = 0
+        self.failed = 0  # updates whose handler has raised
+        self.threads = []
+        self.stopping = False  # set by stop(), the later updates are refused
+        self.submitting = 0  # submit() calls putting an update into a queue
+        self.condition = threading.Condition()
+
+    @staticmethod
+    def chat_of(update):
+        """The chat (or the user) the update comes from, the updates of a poll are kept together"""
+
+        for chat_update in (update.message, update.edited_message, update.channel_post, update.edited_channel_post):
+            if chat_update is not None:
+                return chat_update.chat.id
+        for user_update in (update.callback_query, update.inline_query, update.chosen_inline_result,
+                            update.shipping_query, update.pre_checkout_query):
+            if user_update is not None:
+                return user_update.from_user.id
+        if update.poll is not None:
+            return update.poll.id
+        return 0
+
+    def submit(self, update, timeout: float = 1.0) -> bool:
+        """Queues the update, returns False if the worker stays busy for longer than timeout
+        or if the pool is stopping: the update isn't acknowledged and Telegram delivers it again"""
+
+        jobs = self.queues[hash(self.chat_of(update)) % len(self.queues)]
+        with self.condition:
+            if self.stopping:
+                return False
+            self.submitting += 1
+        try:
+            jobs.put((time.monotonic(), update), timeout=timeout)
+        except queue.Full:
+            return False
+        finally:
+            with self.condition:
+                self.submitting -= 1
+                self.condition.notify_all()
+        return True
+
+    def queue_depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def work(self, jobs: queue.Queue):
+        while 1:
+            job = jobs.get()
+            if job is None:
+                break
+            received_at, update = job
+            try:
+                self.bot.process_new_updates([update])
+            except Exception as e:
+                print(f'Error while processing update {update.update_id}: \n{e}')
+                self.failed += 1
+            self.latencies.append(time.monotonic() - received_at)
+            self.processed += 1
+
+    def start(self):
+        for jobs in self.queues:
+            thread = threading.Thread(target=self.work, args=(jobs,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        """Processes the updates that are already queued and stops the workers"""
+
+        with self.condition:
+            self.stopping = True
+            while self.submitting:  # the updates being queued go before the stop markers
+                self.condition.wait()
+        for jobs in self.queues:
+            jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class WebhookHttpServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # Telegram opens up to 40 connections at once (max_connections of setWebhook)
+
+
+class WebhookServer:
+    """Embedded HTTP server receiving the updates pushed by Telegram, the updates are handed over to the UpdatePool.
+    When the pool is full the server answers with 503, and Telegram delivers the update again later"""
+
+    def __init__(self, pool: UpdatePool, host: str, port: int, path: str):
+        self.pool = pool
+        self.path = path
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Telegram keeps the connections alive
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                if self.path != server.path:
+                    return self.send_error(403)
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                try:
+                    update = telebot.types.Update.de_json(body.decode('utf-8'))
+                except (ValueError, KeyError):
+                    return self.send_error(400)
+                if not server.pool.submit(update):
+                    return self.send_error(503)
+                self.send_response(200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        self.http_server = WebhookHttpServer((host, port), Handler)
+
+    @property
+    def port(self) -> int:
+        return self.http_server.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.http_server.serve_forever, daemon=True)
+        return thread.start()
+
+    def stop(self):
+        """Stops accepting the updates first, then lets the pool finish the queued ones"""
+
+        self.http_server.shutdown()
+        self.http_server.server_close()
+        self.pool.stop()
@@ -0,0 +1,60 @@
+"""Notification worker: sends the notifications of the shards it holds the leases of. Several workers
+(processes on one host sharing the user store) split the users between them and take over the shards
+of a crashed worker. The bot itself is started with config.notify_shards set, so it only answers the chats
+
+    python -m donor_bot.worker
+"""
+
+import signal
+import threading
+
+from donor_bot import bot
+from donor_bot.scheduler import EventScheduler
+from donor_bot.shards import ShardLeases
+from donor_bot.users import today
+
+
+def start(lease: float = 60, worker_id: str = None) -> ShardLeases:
+    """Turns the initialized bot module into a notification worker, returns the worker's leases"""
+
+    leases = ShardLeases(bot.user_store, bot.config.notify_shards, worker_id, lease)
+    share = bot.dispatcher.global_bucket.rate  # the bot process keeps a share of the rate limit for its replies
+
+    def renew():
+        previous = leases.held
+        held = leases.renew()
+        # the workers split the other shares in proportion to the shards they hold
+        bot.dispatcher.global_bucket.rate = share * max(1, len(held))
+        if previous and held - previous:
+            bot.scheduler.call_soon(bot.notifier.decide_when_to_notify)  # the shards taken over are due today too
+
+    bot.notifier.shards = leases
+    renew()
+    # the leases are renewed by a scheduler of their own, a long notifier run doesn't let them expire
+    lease_scheduler = EventScheduler()
+    lease_scheduler.call_every(lease / 3, renew)
+    lease_scheduler.start()
+
+    bot.dispatcher.start()
+    # the users who finish the onboarding in the bot process are picked up within an hour
+    bot.scheduler.call_every(3600, bot.notifier.decide_when_to_notify)
+    bot.scheduler.call_daily(lambda: leases.forget_before(today() - 30))
+    bot.background_processing()
+    return leases
+
+
+def main():
+    bot.init()
+    leases = start()
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    try:
+        stop_event.wait()
+    except KeyboardInterrupt:
+        pass
+    leases.release()
+    bot.dispatcher.stop()
+
+
+if __name__ == '__main__':
+    main()
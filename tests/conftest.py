@@ -0,0 +1,9 @@
+"""The tests import the bot's package and the local stand-ins of benchmarks/ (fake_blood_bank.py)"""
+
+import pathlib
+import sys
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / 'benchmarks'))
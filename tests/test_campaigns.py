@@ -0,0 +1,54 @@
+"""Campaigns: a resumed campaign retries the recipients whose message wasn't handed to the Bot API"""
+
+import types
+from concurrent.futures import Future
+
+from donor_bot.campaigns import Campaigns
+from donor_bot.store import UserStore
+
+
+class Dispatcher:
+    """Makes the calls at once, the chats sent to are kept in bot.sent"""
+
+    def __init__(self):
+        self.bot = types.SimpleNamespace(sent=[])
+        self.bot.send_message = lambda chat_id, text: self.bot.sent.append(chat_id)
+
+    def submit(self, chat_id, method, *args, bulk=False, **kwargs):
+        future = Future()
+        future.set_result(method(*args, **kwargs))
+        return future
+
+
+def campaigns_of(tmp_path, users: int = 300) -> Campaigns:
+    store = UserStore(str(tmp_path / 'user-table.sqlite3'))
+    store.save_many({str(1000 + cid): dict(blood_type='I', blood_rh='(+)', bot_stage=3) for cid in range(users)})
+    campaigns = Campaigns(store, Dispatcher())
+    campaigns.batch_size = 20
+    return campaigns
+
+
+def test_campaign_reaches_every_recipient_once(tmp_path):
+    campaigns = campaigns_of(tmp_path)
+    campaign_id = campaigns.create('I(+)', 'Терміново потрібна кров', admin_id=1)
+    campaigns.wait(campaign_id, 10)
+    assert sorted(campaigns.dispatcher.bot.sent) == list(range(1000, 1300))
+    progress = campaigns.progress(campaign_id)
+    assert (progress.status, progress.total, progress.sent, progress.lost) == ('done', 300, 300, 0)
+    assert campaigns.store.connection.execute('SELECT count(*) FROM campaign_sent').fetchone()[0] == 0
+
+
+def test_resume_sends_the_unmarked_recipients_of_the_batches_in_flight(tmp_path):
+    """The process stopped with the recipients 1100..1199 in flight, 1100..1109 had been handed to the API"""
+
+    campaigns = campaigns_of(tmp_path)
+    connection = campaigns.store.connection
+    connection.execute("INSERT INTO campaigns VALUES (1, 'I', '(+)', NULL, 'Терміново', 1, 'running', 300, "
+                       "'1199', '1099', 100, 0, 0, 0, 0)")
+    connection.executemany('INSERT INTO campaign_sent VALUES (1, ?)', [(str(cid),) for cid in range(1000, 1110)])
+
+    assert campaigns.resume() == [1]
+    campaigns.wait(1, 10)
+    assert sorted(campaigns.dispatcher.bot.sent) == list(range(1110, 1300))
+    progress = campaigns.progress(1)
+    assert (progress.status, progress.sent, progress.lost) == ('done', 290, 10)
@@ -0,0 +1,50 @@
+"""MessageDispatcher: the replies to the users aren't held up by the bulk messages"""
+
+import threading
+import time
+import types
+
+from donor_bot.dispatcher import MessageDispatcher
+
+
+def dispatcher_of(calls: list, workers: int = 1, queue_size: int = 1000) -> MessageDispatcher:
+    def send_message(chat_id, text, **kwargs):
+        time.sleep(0.001)
+        calls.append(text)
+        return text
+
+    return MessageDispatcher(types.SimpleNamespace(send_message=send_message), workers=workers, queue_size=queue_size,
+                             global_rate=10 ** 6, chat_rate=10 ** 6, chat_burst=10 ** 6)
+
+
+def test_reply_overtakes_the_queued_bulk_messages():
+    calls = []
+    dispatcher = dispatcher_of(calls)
+    notifications = [dispatcher.send_message(number, f'notification {number}', bulk=True) for number in range(200)]
+    reply = dispatcher.send_message(1, 'reply')
+    dispatcher.start()
+    assert reply.result(timeout=5) == 'reply'
+    assert calls.index('reply') < 5
+    dispatcher.stop()  # the bulk messages already queued are sent before the workers stop
+    assert all(notification.done() for notification in notifications)
+    assert len(calls) == 201
+
+
+def test_full_bulk_lane_doesnt_block_a_reply():
+    calls = []
+    dispatcher = dispatcher_of(calls, queue_size=10)
+    for number in range(10):
+        dispatcher.send_message(number, f'notification {number}', bulk=True)
+    blocked = threading.Thread(target=dispatcher.send_message, args=(11, 'notification 11'), kwargs={'bulk': True},
+                               daemon=True)
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()  # the bulk sender waits for room
+    started = time.monotonic()
+    reply = dispatcher.send_message(1, 'reply')
+    assert time.monotonic() - started < 0.05
+    dispatcher.start()
+    assert reply.result(timeout=5) == 'reply'
+    blocked.join(5)
+    dispatcher.stop()
+    assert len(calls) == 12
@@ -0,0 +1,46 @@
+"""Blood levels history: the migration of the table created before the blood banks were added"""
+
+import datetime
+
+from sqlalchemy import create_engine, text
+
+from donor_bot.history import DataFrame, HistoryWriter, MysqlDatabase
+from donor_bot.levels import BloodLevels
+
+ENOUGH = ('Достатньо',) * 8
+SHORTAGE = ('Мало',) + ('Достатньо',) * 7
+LEVEL_COLUMNS = ', '.join(f'"{label}"' for label in
+                          ('I (+)', 'II (+)', 'III (+)', 'IV (+)', 'I (–)', 'II (–)', 'III (–)', 'IV (–)'))
+
+
+def legacy_database(path) -> str:
+    """blood_availability as the first version of the bot created it: no source, a row per refresh"""
+
+    url = f'sqlite:///{path / "history.db"}'
+    with create_engine(url).begin() as connection:
+        connection.execute(text(f'CREATE TABLE blood_availability (id INTEGER PRIMARY KEY, date DATE, '
+                                f'{LEVEL_COLUMNS.replace(",", " VARCHAR(50) NOT NULL,")} VARCHAR(50) NOT NULL)'))
+        for day, levels in [('2020-06-01', ENOUGH), ('2020-06-01', SHORTAGE), ('2020-06-02', ENOUGH)]:
+            connection.execute(text(f'INSERT INTO blood_availability (date, {LEVEL_COLUMNS}) VALUES '
+                                    f'(:day, {", ".join(f":level{number}" for number in range(8))})'),
+                               day=day, **{f'level{number}': level for number, level in enumerate(levels)})
+    return url
+
+
+def test_legacy_table_is_migrated(tmp_path):
+    database = MysqlDatabase(legacy_database(tmp_path))
+    database.create_table()
+    database.create_table()  # the next start finds the table up to date
+
+    history = DataFrame.convert_into_data_frame(database)
+    assert history.source_names == ['kmck']
+    assert history.days.tolist() == [(datetime.date(2020, 6, day) - datetime.date(1970, 1, 1)).days for day in (1, 2)]
+    assert history.levels[:, 0].tolist() == [1, 0]  # the latest row of June 1 is kept
+
+    writer = HistoryWriter(database)
+    writer.add(BloodLevels(datetime.date(2020, 6, 2), SHORTAGE), 'kmck')
+    writer.add(BloodLevels(datetime.date(2020, 6, 2), SHORTAGE), 'other')
+    assert writer.flush() == 2
+    history = DataFrame.convert_into_data_frame(database)
+    assert history.source_names == ['kmck', 'other']
+    assert history.levels[:, 0].tolist() == [1, 1, 1]  # June 2 of kmck is replaced, not duplicated
@@ -0,0 +1,103 @@
+"""Notifier: who is notified, rescheduled or kept due, depending on the blood levels"""
+
+import datetime
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from donor_bot.levels import BloodLevels
+from donor_bot.notifier import Notifier
+from donor_bot.parser import BankRegistry, BloodBank, Parser, StructureDriftError
+from donor_bot.store import UserStore
+from donor_bot.users import UserTable, from_day, today
+
+ENOUGH = ('Достатньо',) * 8
+SHORTAGE = ('Мало',) + ('Достатньо',) * 7  # I(+) is short
+
+
+class Dispatcher:
+    """Delivers the messages at once and keeps them"""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(chat_id)
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+@pytest.fixture
+def registry():
+    registry = BankRegistry()
+    cache = registry.register(BloodBank('kmck', 'Київського Центру Крові', (0, 0)), Parser('http://127.0.0.1:9/', 'h4'))
+    cache.snapshot = BloodLevels(datetime.date.today(), SHORTAGE, 'kmck')
+    cache.checked_at = time.time()
+    return registry
+
+
+def notifier_of(tmp_path, registry, users: dict, monday_10: bool = True) -> Notifier:
+    store = UserStore(str(tmp_path / 'user-table.sqlite3'))
+    store.save_many(users)
+    weekday, hour = (time.strftime('%a'), time.strftime('%H')) if monday_10 else ('Never', '99')
+    return Notifier(weekday, hour, UserTable.from_json(users), store, registry, Dispatcher())
+
+
+def donor(blood_type: str = 'I', blood_rh: str = '(+)', notify_day: int = None) -> dict:
+    return dict(blood_type=blood_type, blood_rh=blood_rh, last_donated=from_day(today() - 60), bot_stage=3,
+                notify_date=from_day(notify_day or today()), bank='kmck')
+
+
+def test_short_group_is_notified_and_postponed_by_a_week(tmp_path, registry):
+    notifier = notifier_of(tmp_path, registry, {'1': donor(), '2': donor('II')})
+    notifier.decide_when_to_notify()
+    assert notifier.dispatcher.sent == [1]
+    assert notifier.user_table[1].notify_day == today() + 7
+    assert notifier.store.load_all()[1].notify_day == today() + 7
+
+
+@pytest.mark.parametrize('unusable', ['drift', 'stale'])
+def test_users_without_usable_levels_stay_due(tmp_path, registry, unusable):
+    """A drift of the page (or levels too old) skips the alerts, the end of day run makes the users due tomorrow"""
+
+    cache = registry.caches['kmck']
+    if unusable == 'drift':
+        cache.drift = StructureDriftError('No levels of I(+)')
+    else:
+        cache.checked_at -= 3 * cache.ttl
+    notifier = notifier_of(tmp_path, registry, {'1': donor(), '2': donor('II')})
+    notifier.decide_when_to_notify()
+    assert notifier.dispatcher.sent == []
+    notifier.decide_when_to_notify(end_of_day=True)
+    assert notifier.user_table.due(today()) == {}
+    assert sorted(cid for cids in notifier.user_table.due(today() + 1).values() for cid in cids) == [1, 2]
+    assert sorted(cid for cids in notifier.store.load_all().due(today() + 1).values() for cid in cids) == [1, 2]
+
+
+def test_group_running_short_later_in_the_day_finds_its_users(tmp_path, registry):
+    """The runs before the end of the day keep the users of a group with enough blood due,
+    so the trigger of an enough->low transition still notifies them"""
+
+    cache = registry.caches['kmck']
+    cache.snapshot = BloodLevels(datetime.date.today(), ENOUGH, 'kmck')
+    notifier = notifier_of(tmp_path, registry, {'1': donor(), '2': donor('II')})
+    notifier.decide_when_to_notify()
+    assert notifier.dispatcher.sent == []
+    assert sorted(cid for cids in notifier.user_table.due(today()).values() for cid in cids) == [1, 2]
+
+    cache.snapshot = BloodLevels(datetime.date.today(), SHORTAGE, 'kmck')
+    notifier.decide_when_to_notify({('kmck', 'I(+)')})
+    assert notifier.dispatcher.sent == [1]
+    assert notifier.user_table[1].notify_day == today() + 7
+
+    notifier.decide_when_to_notify(end_of_day=True)
+    assert notifier.user_table[2].notify_day == today() + 1
+    assert notifier.store.load_all()[2].notify_day == today() + 1
+
+
+def test_users_whose_day_has_passed_are_due(tmp_path, registry):
+    notifier = notifier_of(tmp_path, registry, {'1': donor(notify_day=today() - 3), '2': donor(notify_day=today() + 1)})
+    notifier.decide_when_to_notify()
+    assert notifier.dispatcher.sent == [1]
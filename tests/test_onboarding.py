@@ -0,0 +1,56 @@
+"""Onboarding: the /start dialog survives a restart, abandoned sessions expire and stay out of the memory"""
+
+import time
+import tracemalloc
+
+from bench_hot_paths import command_message, stub_sends
+from donor_bot.store import Onboarding, UserStore
+from harness import load_bot
+
+
+def test_dialog_continues_after_a_restart(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # load_bot() moves into the work directory
+    bot = load_bot(str(tmp_path))
+    stub_sends(bot)
+    bot.welcome_message(command_message(bot, 7, '/start'))
+    bot.continue_onboarding(command_message(bot, 7, 'II'))
+    assert bot.onboarding.get(7).stage == 1
+
+    # a new process: a new UserStore and Onboarding on the same file
+    bot = load_bot(str(tmp_path))
+    sent = stub_sends(bot)
+    assert bot.is_onboarding(command_message(bot, 7, '(-)'))
+    bot.continue_onboarding(command_message(bot, 7, '(-)'))
+    bot.continue_onboarding(command_message(bot, 7, '2+ місяців тому'))
+    assert bot.onboarding.get(7) is None
+    assert sent[-1][1].startswith('All done!')
+    record = bot.user_store.load_all()[7]
+    assert (record['blood_type'], record['blood_rh'], record['bot_stage']) == ('II', '(-)', 3)
+
+
+def test_expired_sessions_are_evicted(tmp_path):
+    onboarding = Onboarding(UserStore(str(tmp_path / 'user-table.sqlite3')), ttl=60)
+    onboarding.advance(1, 0)
+    onboarding.advance(2, 1, blood_type='I')
+    onboarding.store.connection.execute('UPDATE onboarding SET updated_at = ? WHERE chat_id = ?',
+                                        (time.time() - 61, '1'))
+    assert onboarding.get(1) is None  # expired, even before the eviction
+    assert onboarding.evict_expired() == 1
+    assert onboarding.evict_expired() == 0
+    assert onboarding.get(2).blood_type == 'I'
+
+
+def test_sessions_are_not_held_in_memory(tmp_path):
+    """100k open dialogs cost the Python heap next to nothing, they live in the store"""
+
+    tracemalloc.start()
+    onboarding = Onboarding(UserStore(str(tmp_path / 'user-table.sqlite3')))
+    before = tracemalloc.get_traced_memory()[0]
+    with onboarding.store.batch():
+        for chat_id in range(100000):
+            onboarding.advance(chat_id, 1, blood_type='III')
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    assert held < 256 * 1024
+    assert onboarding.get(99999).blood_type == 'III'
+    assert onboarding.store.connection.execute('SELECT count(*) FROM onboarding').fetchone()[0] == 100000
@@ -0,0 +1,46 @@
+"""Parser.extract_blood_levels: the levels go to their labels, a changed page raises StructureDriftError"""
+
+import pytest
+
+from donor_bot.parser import Parser, StructureDriftError
+from fake_blood_bank import LABELS, render_page
+from harness import ROOT
+
+SHORTAGE = ['Мало', 'Достатньо', 'Критично мало', 'Достатньо', 'Критично', 'Достатньо', 'Достатньо', 'Дуже мало']
+NEWS = '<h4>Новини</h4><p>День донора</p><h4>Оголошення</h4>'
+
+
+def parser() -> Parser:
+    return Parser('http://127.0.0.1:9/', 'h4')
+
+
+@pytest.mark.parametrize('name', ['kmck-enough.html', 'kmck-shortage.html'])
+def test_fixture_pages_parse(name):
+    page = (ROOT / 'benchmarks' / 'fixtures' / name).read_bytes()
+    assert len(parser().extract_blood_levels(page).levels) == 8
+
+
+def test_other_headings_around_the_block_are_ignored():
+    page = render_page(SHORTAGE).replace('<body>', '<body><h4>Увага донорам</h4>').replace('</body>', NEWS + '</body>')
+    assert parser().extract_blood_levels(page).levels == tuple(SHORTAGE)
+    chunks = [page.encode()[start:start + 7] for start in range(0, len(page.encode()), 7)]
+    assert parser().extract_blood_levels(chunks, 'utf-8').levels == tuple(SHORTAGE)
+
+
+def test_second_heading_after_a_level_is_a_drift():
+    page = render_page(SHORTAGE).replace('<h4>Мало</h4>', '<h4>Оголошення</h4><h4>Мало</h4>', 1)
+    with pytest.raises(StructureDriftError, match='follows the level of I'):
+        parser().extract_blood_levels(page)
+
+
+def test_unknown_level_is_a_drift():
+    page = render_page(['Оголошення'] + SHORTAGE[1:])
+    with pytest.raises(StructureDriftError, match='Unexpected levels'):
+        parser().extract_blood_levels(page)
+
+
+def test_missing_group_is_a_drift():
+    last_block = f'<div class="blood-item"><span class="blood-type">{LABELS[-1]}</span><h4>{SHORTAGE[-1]}</h4></div>'
+    page = render_page(SHORTAGE).replace(last_block, '')
+    with pytest.raises(StructureDriftError, match=r'No levels of IV\(-\)'):
+        parser().extract_blood_levels(page)
@@ -0,0 +1,140 @@
+"""SnapshotCache against a local stand-in of the blood bank's site: freshness, bounded staleness and the 304 path"""
+
+import time
+
+import pytest
+
+from donor_bot.levels import BLOOD_GROUPS
+from donor_bot.parser import (BankRegistry, BloodBank, NoSnapshotError, Parser, SnapshotCache, StaleSnapshotError,
+                              StructureDriftError)
+from donor_bot.scheduler import EventScheduler
+from fake_blood_bank import FakeBloodBank, render_page
+
+ENOUGH = ['Достатньо'] * 8
+SHORTAGE = ['Критично мало'] + ['Достатньо'] * 7
+
+
+@pytest.fixture
+def site():
+    site = FakeBloodBank(ENOUGH).start()
+    yield site
+    if site.server is not None:
+        site.stop()
+
+
+def cache_of(site: FakeBloodBank, ttl: int = 600) -> SnapshotCache:
+    return SnapshotCache(Parser(site.url, 'h4', timeout=1), ttl)
+
+
+def test_refresh_parses_the_page(site):
+    cache = cache_of(site)
+    snapshot = cache.refresh()
+    assert snapshot.levels == tuple(ENOUGH)
+    assert cache.current() is snapshot
+
+
+def test_unchanged_page_costs_a_304_and_keeps_the_snapshot(site):
+    cache = cache_of(site)
+    parsed = []
+    cache.subscribe(parsed.append)
+    first = cache.refresh()
+    assert cache.refresh() is first  # the readers' caches keyed by the snapshot stay valid
+    assert (site.requests, site.not_modified) == (2, 1)
+    assert parsed == [first]
+
+
+def test_changed_page_is_parsed_again(site):
+    cache = cache_of(site)
+    cache.refresh()
+    site.set_levels(SHORTAGE)
+    snapshot = cache.refresh()
+    assert snapshot.is_low(BLOOD_GROUPS[0])
+    assert site.not_modified == 0
+
+
+def test_scheduled_refresh_keeps_the_snapshot_fresh(site):
+    """A change of the page reaches the readers within one ttl"""
+
+    cache = cache_of(site, ttl=0.05)
+    scheduler = EventScheduler()
+    scheduler.call_every(cache.ttl, cache.refresh)
+    scheduler.start()
+    try:
+        deadline = time.monotonic() + 2
+        while cache.snapshot is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        site.set_levels(SHORTAGE)
+        changed = time.monotonic()
+        while not cache.current().is_low(BLOOD_GROUPS[0]) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert cache.current().is_low(BLOOD_GROUPS[0])
+        assert time.monotonic() - changed < 4 * cache.ttl
+    finally:
+        scheduler.stop()
+
+
+def test_readers_never_touch_the_network(site):
+    cache = cache_of(site)
+    with pytest.raises(NoSnapshotError):
+        cache.current()
+    snapshot = cache.refresh()
+    cache.checked_at -= 3 * cache.ttl  # the refreshes have failed for a while
+    assert cache.is_stale()
+    for _ in range(100):
+        assert cache.current() is snapshot  # /update shows the levels with their date
+        with pytest.raises(StaleSnapshotError):
+            cache.current(fresh=True)  # the alerts aren't sent on them
+    assert site.requests == 1
+
+
+def test_site_down_serves_the_last_snapshot(site):
+    cache = cache_of(site)
+    snapshot = cache.refresh()
+    site.stop()
+    site.server = None
+    with pytest.raises(Exception):
+        cache.refresh()
+    started = time.monotonic()
+    assert cache.current() is snapshot
+    assert time.monotonic() - started < 0.01  # no download, not even a refused one
+    assert not cache.is_stale()  # until two checks have been missed
+    assert cache.current(fresh=True) is snapshot
+
+
+def test_saved_snapshot_keeps_its_check_time(site, tmp_path):
+    """A snapshot saved days ago isn't fresh after a restart until the page is checked again"""
+
+    registry = BankRegistry()
+    cache = registry.register(BloodBank('kmck', 'kmck', (0, 0)), Parser(site.url, 'h4', timeout=1))
+    cache.refresh()
+    cache.checked_at -= 3 * 24 * 3600
+    registry.save_snapshots(tmp_path / 'blood-levels.json')
+
+    restarted = BankRegistry()
+    restarted.register(BloodBank('kmck', 'kmck', (0, 0)), Parser(site.url, 'h4', timeout=1))
+    assert restarted.load_snapshots(tmp_path / 'blood-levels.json') == 1
+    assert restarted.snapshot('kmck').levels == tuple(ENOUGH)
+    with pytest.raises(StaleSnapshotError):
+        restarted.snapshot('kmck', fresh=True)
+    restarted.caches['kmck'].refresh()
+    assert restarted.snapshot('kmck', fresh=True).levels == tuple(ENOUGH)
+
+
+def test_drift_ends_when_the_page_is_back(site):
+    """The page changes for a while and comes back as it was: its ETag is answered with a 304"""
+
+    cache = cache_of(site)
+    drifts = []
+    cache.subscribe_drift(drifts.append)
+    snapshot = cache.refresh()
+    page = site.page.decode('utf-8')
+    site.set_page(render_page(ENOUGH).replace('IV (–)', 'IV'))  # a label is gone
+    with pytest.raises(StructureDriftError):
+        cache.refresh()
+    with pytest.raises(StructureDriftError):
+        cache.current()
+    site.set_page(page)
+    assert cache.refresh() == snapshot
+    assert site.not_modified == 1
+    assert cache.current() == snapshot
+    assert len(drifts) == 1
@@ -0,0 +1,69 @@
+"""UserStore: the one-shot import of user-table.json and the state left by a writer that was killed"""
+
+import datetime
+import json
+import subprocess
+import sys
+
+from donor_bot.store import UserStore
+from harness import ROOT
+
+USERS = {'1': dict(blood_type='I', blood_rh='(+)', last_donated='2020-03-01', bot_stage=3,
+                   notify_date='2020-05-01', bank='kmck'),
+         '2': dict(blood_type='III', blood_rh=None, last_donated=None, bot_stage=1, notify_date=None)}
+
+# writes a committed user, then is killed in the middle of a batch without closing the database
+KILLED_WRITER = '''
+import os, sys
+sys.path.insert(0, {root!r})
+from donor_bot.store import UserStore
+store = UserStore({path!r})
+store.save('10', dict(blood_type='II', blood_rh='(-)', bot_stage=3, notify_date='2020-05-01'))
+with store.batch():
+    store.save('11', dict(blood_type='IV', blood_rh='(+)', bot_stage=3))
+    store.save_field(['10'], 'notify_date', '2020-06-01')
+    os._exit(0)
+'''
+
+
+def test_users_are_migrated_from_json_once(tmp_path):
+    json_path = tmp_path / 'user-table.json'
+    json_path.write_text(json.dumps(USERS))
+    store = UserStore(str(tmp_path / 'user-table.sqlite3'))
+    store.migrate_from_json(str(json_path))
+    users = store.load_all()
+    assert users.to_json() == {'1': USERS['1'], '2': dict(USERS['2'], bank='kmck')}
+
+    store.save_field(['1'], 'bot_stage', 0)
+    store.migrate_from_json(str(json_path))  # the store has users, the json file is ignored
+    assert store.load_all()[1]['bot_stage'] == 0
+
+
+def test_missing_json_leaves_the_store_empty(tmp_path):
+    store = UserStore(str(tmp_path / 'user-table.sqlite3'))
+    store.migrate_from_json(str(tmp_path / 'user-table.json'))
+    assert store.is_empty()
+
+
+def test_killed_writer_loses_only_its_open_batch(tmp_path):
+    path = str(tmp_path / 'user-table.sqlite3')
+    subprocess.run([sys.executable, '-c', KILLED_WRITER.format(root=str(ROOT), path=path)], check=True, timeout=30)
+
+    store = UserStore(path)
+    users = store.load_all()
+    assert list(users) == [10]
+    assert users[10]['notify_date'] == '2020-05-01'
+    with store.batch():  # the killed process doesn't hold the write lock
+        store.save('12', dict(blood_type='I', blood_rh='(+)', bot_stage=3))
+    assert sorted(store.load_all()) == [10, 12]
+
+
+def test_load_due_reads_only_the_users_due(tmp_path):
+    store = UserStore(str(tmp_path / 'user-table.sqlite3'))
+    store.save_many(USERS)
+    store.save('3', dict(USERS['1'], notify_date='2020-05-02'))
+    store.save('4', dict(USERS['1'], notify_date='2020-04-30'))
+    day = datetime.date(2020, 5, 1).toordinal()
+    assert sorted(store.load_due(day)) == [1, 4]
+    assert sorted(store.load_due(day).due(day)) == [('kmck', 'I(+)')]
+    assert len(store.load_due(day - 100)) == 0
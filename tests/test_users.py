@@ -0,0 +1,94 @@
+"""UserTable: the chat id lookup (bisection plus the recent users), extend() and due()"""
+
+import random
+import threading
+
+from donor_bot.users import UserTable, from_day, today
+
+
+def record(blood_type='I', blood_rh='(+)', bot_stage=3, notify_day=None, bank=None) -> dict:
+    return dict(blood_type=blood_type, blood_rh=blood_rh, last_donated=from_day(today() - 60), bot_stage=bot_stage,
+                notify_date=from_day(today() if notify_day is None else notify_day), bank=bank)
+
+
+def test_chat_ids_are_found_by_bisection():
+    chat_ids = random.Random(1).sample(range(-10 ** 12, 10 ** 12), 5000)  # group chats have negative ids
+    table = UserTable.from_json({str(cid): record(blood_type='II' if cid % 2 else 'IV') for cid in chat_ids})
+    assert table.recent == {}
+    assert list(table.lookup[0]) == sorted(chat_ids)
+    for cid in chat_ids[:500]:
+        assert table[cid]['blood_type'] == ('II' if cid % 2 else 'IV')
+        assert table[str(cid)].row == table.row_of(cid)
+    assert 10 ** 12 not in table
+    assert table.get(10 ** 12) is None
+
+
+def test_new_users_wait_in_recent_until_the_lookup_is_sorted_again():
+    table = UserTable.from_json({str(cid): record() for cid in range(0, 2000, 2)})
+    for cid in range(1, 2 * 256, 2):
+        table[cid] = record('III')
+    assert len(table.recent) == 256
+    assert len(table.lookup[0]) == 1000  # the sorted copy still holds the first users only
+    assert table[511]['blood_type'] == 'III'
+
+    table[513] = record('III')  # one more than max(256, size // 16) sorts the lookup
+    assert table.recent == {}
+    assert len(table.lookup[0]) == len(table) == 1257
+    assert all(table.row_of(cid) is not None for cid in range(0, 514))
+
+
+def test_readers_find_every_user_while_the_lookup_is_swapped():
+    """Reads don't take the lock: the new lookup is in place before the recent users are dropped"""
+
+    table = UserTable()
+    table.extend((cid, *record().values()) for cid in range(100))
+    stop, missed = threading.Event(), []
+
+    def read():
+        known = 100
+        while not stop.is_set():
+            size = len(table)  # the users below it have been added
+            for cid in (known - 1, size - 1, random.randrange(max(size, 1))):
+                if cid >= 0 and table.row_of(cid) is None:
+                    missed.append(cid)
+            known = size
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for cid in range(100, 20000):
+        table[cid] = record()
+    stop.set()
+    reader.join()
+    assert missed == []
+
+
+def test_extend_encodes_the_json_records():
+    table = UserTable(capacity=2)
+    table[5] = record()
+    table.extend([('7', 'IV', '(-)', '2020-01-31', 3, '2020-04-01', 'lviv'),
+                  ('9', None, None, None, 0, None, None)])
+    assert len(table) == 3
+    assert len(table.chat_id) >= 3  # the columns have grown
+    assert table[7].to_json() == dict(blood_type='IV', blood_rh='(-)', last_donated='2020-01-31', bot_stage=3,
+                                      notify_date='2020-04-01', bank='lviv')
+    assert table[9].to_json() == dict(blood_type=None, blood_rh=None, last_donated=None, bot_stage=0,
+                                      notify_date=None, bank='kmck')
+    assert table[5]['bank'] == 'kmck'
+    assert UserTable.from_json(table.to_json()).to_json() == table.to_json()
+
+
+def test_due_groups_the_users_by_bank_and_blood_group():
+    table = UserTable.from_json({
+        '1': record(),
+        '2': record(bank='lviv'),
+        '3': record(notify_day=today() - 2),  # overdue
+        '4': record('II', '(-)'),
+        '5': record(notify_day=today() + 1),
+        '6': record(bot_stage=0),  # sent back to /start
+        '7': record(blood_rh=None),
+        '8': dict(record(), notify_date=None),
+    })
+    assert table.due(today()) == {('kmck', 'I(+)'): [1, 3], ('lviv', 'I(+)'): [2], ('kmck', 'II(-)'): [4]}
+    table.set_notify_day([1, 3], today() + 7)
+    assert table.due(today()) == {('lviv', 'I(+)'): [2], ('kmck', 'II(-)'): [4]}
+    assert table.due(today() + 1)[('kmck', 'I(+)')] == [5]
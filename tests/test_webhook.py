@@ -0,0 +1,53 @@
+"""UpdatePool: the updates are spread by chat and none of the acknowledged ones is lost on stop"""
+
+import threading
+import time
+import types
+
+import telebot
+
+from donor_bot.webhook import UpdatePool
+
+USER = {'id': 42, 'is_bot': False, 'first_name': 'Donor'}
+CHAT = {'id': 42, 'type': 'private'}
+
+
+def update_of(update_id: int, **fields):
+    return telebot.types.Update.de_json(dict(update_id=update_id, **fields))
+
+
+def test_updates_are_keyed_by_their_chat():
+    message = {'message_id': 1, 'date': 0, 'chat': CHAT, 'from': USER, 'text': '/update'}
+    updates = [update_of(1, message=message), update_of(2, edited_message=message),
+               update_of(3, inline_query={'id': '7', 'from': USER, 'query': '', 'offset': ''}),
+               update_of(4, callback_query={'id': '8', 'from': USER, 'chat_instance': '1', 'data': 'add_one_week'}),
+               update_of(5, chosen_inline_result={'result_id': 'kmck', 'from': USER, 'query': ''})]
+    assert [UpdatePool.chat_of(update) for update in updates] == [42] * 5
+
+
+def test_stop_processes_the_queued_updates_and_refuses_the_later_ones():
+    processed = []
+    release = threading.Event()
+
+    def process_new_updates(updates):
+        release.wait(5)
+        processed.extend(update.update_id for update in updates)
+
+    pool = UpdatePool(types.SimpleNamespace(process_new_updates=process_new_updates), workers=1, queue_size=1)
+    pool.start()
+    message = {'message_id': 1, 'date': 0, 'chat': CHAT, 'from': USER, 'text': '/update'}
+    assert pool.submit(update_of(1, message=message))  # taken by the worker, which waits for the release
+    assert pool.submit(update_of(2, message=message))  # fills the queue
+    late = []
+    blocked = threading.Thread(target=lambda: late.append(pool.submit(update_of(3, message=message), timeout=5)))
+    blocked.start()  # waits for room in the queue, as a keep-alive connection of the server would
+    while not pool.submitting:
+        time.sleep(0.001)
+    stopper = threading.Thread(target=pool.stop)
+    stopper.start()
+    release.set()
+    stopper.join(10)
+    blocked.join(10)
+    assert late == [True]
+    assert processed == [1, 2, 3]  # the update accepted while stopping isn't left behind the stop marker
+    assert not pool.submit(update_of(4, message=message))  # Telegram delivers it again to the next process